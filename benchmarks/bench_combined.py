@@ -0,0 +1,107 @@
+"""Compare matching every rule in turn with matching them all at once through combined regular expressions (`CombinedMatcher`), and with the index.
+
+Also compares the index with and without the combined matcher for its always-candidate wildcard rules, on rule sets with many of them.
+
+Run from the repository root with `python -m benchmarks.bench_combined`; results are printed as JSON.
+"""
+from pathlib import Path
+import json
+import random
+import sys
+import time
+
+from codeowners import CombinedMatcher, CompiledCodeOwners, anchor_path, parse_code_owners
+from benchmarks.synthetic import SUB_FOLDERS, generate_codeowners, generate_paths
+from benchmarks.bench_resolve import resolve_reverse
+
+RULE_COUNTS = [100, 1000, 4000]
+# wildcard rules added to the rule set for the fallback comparison
+WILDCARD_RULE_COUNTS = [10, 100, 500]
+PATH_COUNT = 2000
+
+
+def generate_wildcard_rules(rule_count: int, seed: int = 0) -> str:
+    """Rules the index can't narrow down, as they don't start with a literal folder or end with a plain extension."""
+    rng = random.Random(seed)
+    lines = list()
+    for index in range(rule_count):
+        kind = rng.random()
+        if kind < 0.5:
+            pattern = f'*/project{rng.randrange(rule_count * 10):05d}/'
+        elif kind < 0.8:
+            pattern = f'**/*{rng.randrange(1000):03d}.*'
+        else:
+            pattern = f'?{rng.choice(SUB_FOLDERS)[1:]}/*'
+        lines.append(f'{pattern} @example-org/wildcard{index}')
+    return '\n'.join(lines) + '\n'
+
+
+def timed(function):
+    before = time.perf_counter()
+    result = function()
+    return time.perf_counter() - before, result
+
+
+def bench_combined(rule_count: int) -> dict:
+    codeowners = CompiledCodeOwners(parse_code_owners(Path('CODEOWNERS'), generate_codeowners(rule_count)))
+    # anchored up front, as matching the rules directly and through the combined matcher doesn't do it
+    paths = [anchor_path(path) for path in generate_paths(PATH_COUNT, rule_count)]
+    rule_indexes = range(len(codeowners))
+
+    translate_seconds, regex_sources = timed(lambda: [codeowners.matchers.get_regex_source(index) for index in rule_indexes])
+    combined_compile_seconds, combined = timed(lambda: CombinedMatcher(rule_indexes, regex_sources))
+    per_rule_compile_seconds, _ = timed(lambda: list(codeowners.matchers))
+
+    per_rule_seconds, expected = timed(lambda: [resolve_reverse(codeowners, path) for path in paths])
+    combined_seconds, resolved = timed(lambda: [combined.match(path) for path in paths])
+    assert [codeowners.specifications[index] if index >= 0 else None for index in resolved] == expected
+    indexed_seconds, resolved = timed(lambda: [codeowners.resolve(path) for path in paths])
+    assert resolved == expected
+    return {
+        'rules': rule_count,
+        'paths': PATH_COUNT,
+        'translate_seconds': translate_seconds,
+        'per_rule_compile_seconds': per_rule_compile_seconds,
+        'combined_compile_seconds': combined_compile_seconds,
+        'per_rule_seconds': per_rule_seconds,
+        'combined_seconds': combined_seconds,
+        'indexed_seconds': indexed_seconds,
+    }
+
+
+def bench_fallback(wildcard_rule_count: int, rule_count: int = 1000) -> dict:
+    content = generate_codeowners(rule_count) + generate_wildcard_rules(wildcard_rule_count)
+    specifications = list(parse_code_owners(Path('CODEOWNERS'), content))
+    paths = generate_paths(PATH_COUNT, rule_count)
+
+    separate = CompiledCodeOwners(specifications)
+    separate.fallback_rules = frozenset()
+    combined = CompiledCodeOwners(specifications, separate.matchers)
+    # compile everything up front, so that only matching is timed
+    list(separate.matchers)
+    combined.get_fallback_matcher()
+
+    # the best of a few runs, as the difference can be smaller than the noise
+    separate_seconds, expected = min((timed(lambda: [separate.resolve(path) for path in paths]) for _ in range(3)), key=lambda timing: timing[0])
+    combined_seconds, resolved = min((timed(lambda: [combined.resolve(path) for path in paths]) for _ in range(3)), key=lambda timing: timing[0])
+    assert resolved == expected
+    return {
+        'rules': len(specifications),
+        'wildcard_rules': len(combined.index.fallback),
+        'paths': PATH_COUNT,
+        'indexed_seconds': separate_seconds,
+        'indexed_combined_fallback_seconds': combined_seconds,
+    }
+
+
+def main() -> None:
+    results = {
+        'combined': [bench_combined(rule_count) for rule_count in RULE_COUNTS],
+        'fallback': [bench_fallback(wildcard_rule_count) for wildcard_rule_count in WILDCARD_RULE_COUNTS],
+    }
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
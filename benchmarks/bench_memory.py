@@ -0,0 +1,62 @@
+"""Compare the memory used by parsed rules against the original representation: a plain dataclass with an owners list per rule.
+
+Run from the repository root with `python -m benchmarks.bench_memory`; results are printed as JSON.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+import json
+import sys
+import tracemalloc
+
+from codeowners import parse_code_owners
+from benchmarks.synthetic import generate_codeowners
+
+RULE_COUNTS = [1000, 4000, 20000]
+
+
+@dataclass
+class UnslottedCodeOwnerSpecification:
+    nearest_comment: Optional[str]
+    glob_pattern: str
+    owners: list
+    line_number: int
+    codeowners_file_path: Path
+
+
+def parse_unslotted(codeowners_file_path: Path, codeowners_content: str):
+    return [
+        UnslottedCodeOwnerSpecification(specification.nearest_comment, specification.glob_pattern, list(specification.owners), specification.line_number, codeowners_file_path)
+        for specification in parse_code_owners(codeowners_file_path, codeowners_content)
+    ]
+
+
+def parse_slotted(codeowners_file_path: Path, codeowners_content: str):
+    return list(parse_code_owners(codeowners_file_path, codeowners_content))
+
+
+def measure(parse, codeowners_content: str) -> int:
+    tracemalloc.start()
+    rules = parse(Path('CODEOWNERS'), codeowners_content)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rules
+    return size
+
+
+def main() -> None:
+    results = []
+    for rule_count in RULE_COUNTS:
+        codeowners_content = generate_codeowners(rule_count)
+        measure(parse_slotted, codeowners_content) # warm up the shared owner tuples, as a long running plugin host would have
+        results.append({
+            'rules': rule_count,
+            'unslotted_bytes': measure(parse_unslotted, codeowners_content),
+            'slotted_bytes': measure(parse_slotted, codeowners_content),
+        })
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
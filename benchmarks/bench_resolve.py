@@ -0,0 +1,71 @@
+"""Compare resolution strategies: forward (keep the last match), reverse (stop at the first match from the bottom) and indexed (only test candidate rules).
+
+Run from the repository root with `python -m benchmarks.bench_resolve`; results are printed as JSON.
+The defaults finish in a few seconds; pass i.e. `--rules 100 1000 4000 20000 --paths 2000` for larger rule sets.
+"""
+from pathlib import Path
+import argparse
+import json
+import sys
+import time
+
+from codeowners import CompiledCodeOwners, anchor_path, parse_code_owners
+from benchmarks.synthetic import generate_codeowners, generate_paths
+
+RULE_COUNTS = [100, 1000, 4000]
+PATH_COUNT = 500
+
+
+def resolve_forward(codeowners: CompiledCodeOwners, path: str):
+    resolved = None
+    for specification, matcher in zip(codeowners.specifications, codeowners.matchers):
+        if matcher.fullmatch(path):
+            resolved = specification
+    return resolved
+
+
+def resolve_reverse(codeowners: CompiledCodeOwners, path: str):
+    for index in range(len(codeowners.matchers) - 1, -1, -1):
+        if codeowners.matchers[index].fullmatch(path):
+            return codeowners.specifications[index]
+    return None
+
+
+STRATEGIES = {
+    'forward': resolve_forward,
+    'reverse': resolve_reverse,
+    'indexed': CompiledCodeOwners.resolve,
+}
+
+
+def time_resolution(resolve, codeowners, paths):
+    before = time.perf_counter()
+    results = [resolve(codeowners, path) for path in paths]
+    return time.perf_counter() - before, results
+
+
+def bench_strategies(rule_count: int, path_count: int) -> dict:
+    codeowners = CompiledCodeOwners(parse_code_owners(Path('CODEOWNERS'), generate_codeowners(rule_count)))
+    # anchored up front, as the strategies which match the rules directly don't do it themselves
+    paths = [anchor_path(path) for path in generate_paths(path_count, rule_count)]
+    result = {'rules': rule_count, 'paths': path_count}
+    expected = None
+    for name, resolve in STRATEGIES.items():
+        seconds, resolved = time_resolution(resolve, codeowners, paths)
+        assert expected is None or resolved == expected, name
+        expected = resolved
+        result[f'{name}_seconds'] = seconds
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rules', type=int, nargs='+', default=RULE_COUNTS, help='the sizes of the synthetic CODEOWNERS files')
+    parser.add_argument('--paths', type=int, default=PATH_COUNT, help='how many paths to resolve against each')
+    args = parser.parse_args()
+    json.dump([bench_strategies(rule_count, args.paths) for rule_count in args.rules], sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""Performance baseline for parsing, glob matching, owner resolution and the git changed files pipeline, on synthetic CODEOWNERS files and paths.
+
+Run from the repository root with `python -m benchmarks.bench_suite`; results are printed as JSON (or written with `--output`),
+and can be compared with an earlier run using `--compare`, i.e. to check for regressions between commits:
+
+    python -m benchmarks.bench_suite --output before.json
+    git checkout other-branch
+    python -m benchmarks.bench_suite --compare before.json
+
+The default sizes finish in a minute or two; pass i.e. `--rules 100 1000 20000 --paths 1000 100000 1000000` for the full range.
+"""
+from pathlib import Path
+from subprocess import run
+from typing import Callable, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from codeowners import CompiledCodeOwners, compile_codeowner_glob, does_codeowner_glob_match, get_resolved_code_owners_for_file, iter_resolved_code_owners, parse_code_owners
+from git import get_git_changed_files_compared_to_default_branch, stream_git_changed_files_compared_to_default_branch
+from benchmarks.synthetic import generate_codeowners, generate_paths
+
+DEFAULT_RULE_COUNTS = [100, 1000, 5000, 20000]
+DEFAULT_PATH_COUNTS = [1000, 10000, 100000]
+DEFAULT_CHANGED_FILE_COUNTS = [100, 2000]
+# glob matching is timed on a fixed number of rule and path pairs, as it is the same work regardless of the file size
+GLOB_MATCH_COUNT = 20000
+# how much a timing can grow before `--compare` reports it as a regression
+REGRESSION_THRESHOLD = 1.25
+
+
+def best_of(repeat: int, function: Callable[[], object]) -> Dict[str, float]:
+    """Time the function `repeat` times, reporting the first run separately as it includes filling any caches."""
+    timings = []
+    for _ in range(repeat):
+        before = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - before)
+    return {'first_seconds': timings[0], 'best_seconds': min(timings)}
+
+
+def bench_parse(rule_counts: List[int], repeat: int) -> List[dict]:
+    results = []
+    for rule_count in rule_counts:
+        content = generate_codeowners(rule_count)
+        results.append({
+            'benchmark': 'parse_code_owners',
+            'rules': rule_count,
+            **best_of(repeat, lambda: list(parse_code_owners(Path('CODEOWNERS'), content))),
+        })
+        specifications = list(parse_code_owners(Path('CODEOWNERS'), content))
+        results.append({
+            'benchmark': 'compile_code_owners',
+            'rules': rule_count,
+            **best_of(repeat, lambda: CompiledCodeOwners(specifications)),
+        })
+    return results
+
+
+def bench_glob_match(repeat: int) -> List[dict]:
+    specifications = list(parse_code_owners(Path('CODEOWNERS'), generate_codeowners(GLOB_MATCH_COUNT)))
+    paths = generate_paths(GLOB_MATCH_COUNT, GLOB_MATCH_COUNT)
+    pairs = list(zip((specification.glob_pattern for specification in specifications), paths))
+
+    def match_all() -> None:
+        for glob_pattern, path in pairs:
+            does_codeowner_glob_match(glob_pattern, path)
+
+    # the first run compiles each distinct pattern, later runs only match
+    compile_codeowner_glob.cache_clear()
+    return [{'benchmark': 'does_codeowner_glob_match', 'matches': len(pairs), **best_of(repeat, match_all)}]
+
+
+def bench_resolve(rule_counts: List[int], path_counts: List[int], repeat: int) -> List[dict]:
+    results = []
+    all_paths = generate_paths(max(path_counts), max(rule_counts))
+    for rule_count in rule_counts:
+        specifications = list(parse_code_owners(Path('CODEOWNERS'), generate_codeowners(rule_count)))
+        for path_count in path_counts:
+            paths = all_paths[:path_count]
+            # a new rule set each time, so that the first run includes compiling the rules it needs
+            codeowners = CompiledCodeOwners(specifications)
+
+            def resolve_each() -> None:
+                for path in paths:
+                    get_resolved_code_owners_for_file(codeowners, path)
+
+            results.append({'benchmark': 'get_resolved_code_owners_for_file', 'rules': rule_count, 'paths': path_count, **best_of(repeat, resolve_each)})
+            results.append({
+                'benchmark': 'iter_resolved_code_owners',
+                'rules': rule_count,
+                'paths': path_count,
+                **best_of(repeat, lambda: sum(1 for _ in iter_resolved_code_owners(codeowners, sorted(paths)))),
+            })
+    return results
+
+
+def _git(repo: Path, *args: str, input: Optional[str] = None) -> str:
+    return run(['git', '-c', 'user.name=bench', '-c', 'user.email=bench@example.com', *args], cwd=repo, input=input, check=True, capture_output=True, encoding='utf-8').stdout
+
+
+def create_git_repo(repo: Path, codeowners_content: str, changed_paths: List[str]) -> None:
+    """A repository whose default branch (`origin/HEAD`) has only a CODEOWNERS file, checked out on a branch which adds the given files.
+
+    The files are added through the index, which is much quicker than `git add` for a great many files, then checked out,
+    as the diff is against the working tree.
+    """
+    _git(repo, 'init', '-q', '-b', 'main')
+    (repo / '.github').mkdir()
+    (repo / '.github' / 'CODEOWNERS').write_text(codeowners_content, encoding='utf-8')
+    _git(repo, 'add', '.github/CODEOWNERS')
+    _git(repo, 'commit', '-q', '-m', 'codeowners')
+    _git(repo, 'update-ref', 'refs/remotes/origin/main', 'HEAD')
+    _git(repo, 'symbolic-ref', 'refs/remotes/origin/HEAD', 'refs/remotes/origin/main')
+
+    _git(repo, 'checkout', '-q', '-b', 'feature')
+    empty_blob = _git(repo, 'hash-object', '-w', '--stdin', input='').strip()
+    _git(repo, 'update-index', '--add', '-z', '--index-info', input=''.join(f'100644 {empty_blob}\t{path}\0' for path in changed_paths))
+    _git(repo, 'commit', '-q', '-m', 'changes')
+    _git(repo, 'checkout-index', '-a')
+
+
+def bench_git_pipeline(changed_file_counts: List[int], rule_count: int, repeat: int) -> List[dict]:
+    results = []
+    codeowners_content = generate_codeowners(rule_count)
+    codeowners = CompiledCodeOwners(parse_code_owners(Path('.github/CODEOWNERS'), codeowners_content))
+    for changed_file_count in changed_file_counts:
+        with tempfile.TemporaryDirectory() as folder:
+            repo = Path(folder)
+            create_git_repo(repo, codeowners_content, generate_paths(changed_file_count, rule_count))
+
+            def resolve_changed_files() -> None:
+                changed_files = get_git_changed_files_compared_to_default_branch(repo)
+                assert sum(1 for _ in iter_resolved_code_owners(codeowners, changed_files)) == changed_file_count
+
+            async def stream_changed_files() -> int:
+                count = 0
+                async for changed_files in stream_git_changed_files_compared_to_default_branch(repo):
+                    count += sum(1 for _ in iter_resolved_code_owners(codeowners, changed_files))
+                return count
+
+            def resolve_streamed_changed_files() -> None:
+                assert asyncio.run(stream_changed_files()) == changed_file_count
+
+            results.append({'benchmark': 'git_changed_files_owners', 'rules': rule_count, 'changed_files': changed_file_count, **best_of(repeat, resolve_changed_files)})
+            results.append({'benchmark': 'git_changed_files_owners_streamed', 'rules': rule_count, 'changed_files': changed_file_count, **best_of(repeat, resolve_streamed_changed_files)})
+    return results
+
+
+def get_commit() -> Optional[str]:
+    p = run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), capture_output=True, encoding='utf-8')
+    return p.stdout.strip() if p.returncode == 0 else None
+
+
+def _result_key(result: dict) -> tuple:
+    return tuple(sorted((key, value) for key, value in result.items() if not key.endswith('_seconds')))
+
+
+def compare(baseline: dict, current: dict) -> List[str]:
+    """Describe how the best timings changed since the baseline run, flagging those which got noticeably slower."""
+    baseline_results = {_result_key(result): result for result in baseline['results']}
+    lines = []
+    for result in current['results']:
+        previous = baseline_results.get(_result_key(result))
+        if not previous:
+            continue
+        ratio = result['best_seconds'] / previous['best_seconds'] if previous['best_seconds'] else float('inf')
+        description = ', '.join(f'{key}={value}' for key, value in _result_key(result))
+        flag = ' REGRESSION' if ratio > REGRESSION_THRESHOLD else ''
+        lines.append(f'{description}: {previous["best_seconds"]:.4f}s -> {result["best_seconds"]:.4f}s ({ratio:.2f}x){flag}')
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rules', type=int, nargs='+', default=DEFAULT_RULE_COUNTS, help='the sizes of the synthetic CODEOWNERS files')
+    parser.add_argument('--paths', type=int, nargs='+', default=DEFAULT_PATH_COUNTS, help='the sizes of the synthetic path sets')
+    parser.add_argument('--changed-files', type=int, nargs='+', default=DEFAULT_CHANGED_FILE_COUNTS, help='how many files the temporary git repository has changed')
+    parser.add_argument('--repeat', type=int, default=3, help='how many times to time each benchmark, the best time is kept')
+    parser.add_argument('--skip-git', action='store_true', help="don't time the git pipeline")
+    parser.add_argument('--output', type=Path, help='write the results to this file instead of printing them')
+    parser.add_argument('--compare', type=Path, help='a previous output to compare the results with')
+    args = parser.parse_args()
+
+    results = bench_parse(args.rules, args.repeat)
+    results.extend(bench_glob_match(args.repeat))
+    results.extend(bench_resolve(args.rules, args.paths, args.repeat))
+    if not args.skip_git:
+        results.extend(bench_git_pipeline(args.changed_files, max(args.rules), args.repeat))
+
+    report = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + '\n', encoding='utf-8')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        for line in compare(json.loads(args.compare.read_text(encoding='utf-8')), report):
+            print(line, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
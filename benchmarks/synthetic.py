@@ -0,0 +1,60 @@
+"""Deterministic generators for synthetic CODEOWNERS files and repository paths, used by the benchmarks."""
+import random
+from typing import List
+
+TOP_LEVEL_FOLDERS = ['apps', 'services', 'libs', 'docs', 'tools', 'infra', 'packages', 'vendor']
+SUB_FOLDERS = ['src', 'test', 'tests', 'build', 'logs', 'config', 'scripts', 'assets', 'internal', 'api']
+EXTENSIONS = ['py', 'js', 'ts', 'tsx', 'go', 'md', 'json', 'yml', 'txt', 'sql', 'proto', 'css', 'html', 'sh']
+
+
+def _project_name(rng: random.Random, project_count: int) -> str:
+    return f'project{rng.randrange(project_count):05d}'
+
+
+def _team(rng: random.Random) -> str:
+    return f'@example-org/team{rng.randrange(500):03d}'
+
+
+def generate_codeowners(rule_count: int, seed: int = 0) -> str:
+    """Generate CODEOWNERS content with a realistic mix of anchored, extension, globstar and `dir/*` rules."""
+    rng = random.Random(seed)
+    project_count = max(rule_count, 10)
+    lines = ['# Default owners', '*       @example-org/everyone', '']
+    rules = 0
+    while rules < rule_count - 1:
+        if rng.random() < 0.2:
+            lines.append('')
+            lines.append(f'# Owned by squad {rng.randrange(1000)}')
+        kind = rng.random()
+        top = rng.choice(TOP_LEVEL_FOLDERS)
+        project = _project_name(rng, project_count)
+        if kind < 0.55:
+            pattern = f'/{top}/{project}/'
+        elif kind < 0.65:
+            pattern = f'/{top}/{project}/{rng.choice(SUB_FOLDERS)}/'
+        elif kind < 0.75:
+            pattern = f'*.{rng.choice(EXTENSIONS)}'
+        elif kind < 0.85:
+            pattern = f'**/{rng.choice(SUB_FOLDERS)}'
+        elif kind < 0.95:
+            pattern = f'{top}/{project}/*'
+        else:
+            pattern = f'{project}/'
+        owners = ' '.join(_team(rng) for _ in range(rng.randint(1, 3)))
+        lines.append(f'{pattern} {owners}')
+        rules += 1
+    return '\n'.join(lines) + '\n'
+
+
+def generate_paths(path_count: int, rule_count: int = 1000, seed: int = 0) -> List[str]:
+    """Generate repository relative file paths which fall under the folders used by `generate_codeowners`."""
+    rng = random.Random(seed + 1)
+    project_count = max(rule_count, 10)
+    paths = []
+    for index in range(path_count):
+        parts = [rng.choice(TOP_LEVEL_FOLDERS), _project_name(rng, project_count)]
+        for _ in range(rng.randint(0, 3)):
+            parts.append(rng.choice(SUB_FOLDERS))
+        parts.append(f'file{index}.{rng.choice(EXTENSIONS)}')
+        paths.append('/'.join(parts))
+    return paths
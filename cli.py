@@ -0,0 +1,333 @@
+"""Command line interface, for using CodeOwnerInsights outside of Sublime Text i.e. in CI.
+
+Run from the package folder with `python -m cli --help`.
+"""
+from argparse import ArgumentParser, Namespace
+from collections import Counter, deque
+from concurrent.futures import Executor
+from itertools import chain, islice
+from pathlib import Path
+from subprocess import CalledProcessError
+from typing import TYPE_CHECKING, BinaryIO, Callable, Deque, Iterable, Iterator, List, Optional, TextIO, Tuple
+import json
+import os
+import sys
+
+try:
+    from .codeowners import CompiledCodeOwners, OwnershipHistory, diff_ownership, find_covered_rules, find_dead_rules, get_code_owners_at_revision, get_code_owners_file, iter_resolved_code_owners, parse_code_owners
+except ImportError:
+    from codeowners import CompiledCodeOwners, OwnershipHistory, diff_ownership, find_covered_rules, find_dead_rules, get_code_owners_at_revision, get_code_owners_file, iter_resolved_code_owners, parse_code_owners
+
+if TYPE_CHECKING:
+    try:
+        from .git import GitCatFile
+    except ImportError:
+        from git import GitCatFile
+
+
+def read_code_owners_file(repo_root: Path, codeowners_file: Optional[Path]) -> Tuple[Path, str]:
+    codeowners_file = codeowners_file or get_code_owners_file(repo_root)
+    if not codeowners_file:
+        raise SystemExit(f'No CODEOWNERS file found in {repo_root}')
+    return (codeowners_file, codeowners_file.read_text(encoding='utf-8'))
+
+
+def open_git_cat_file(repo_root: Path) -> 'GitCatFile':
+    """One pair of `git cat-file` processes for a whole command, however many revisions it reads CODEOWNERS at."""
+    try:
+        from .git import GitCatFile
+    except ImportError:
+        from git import GitCatFile
+    return GitCatFile(repo_root)
+
+
+def load_code_owners_at_revision(cat_file: 'GitCatFile', revision: str) -> CompiledCodeOwners:
+    codeowners = get_code_owners_at_revision(cat_file, revision)
+    if codeowners is None:
+        raise SystemExit(f'No CODEOWNERS file found in {cat_file.folder_path} at {revision}')
+    return codeowners
+
+
+def iter_working_tree_files(repo_root: Path) -> Iterator[str]:
+    for folder, sub_folders, files in os.walk(repo_root):
+        sub_folders[:] = sorted(sub_folder for sub_folder in sub_folders if sub_folder != '.git')
+        relative_folder = os.path.relpath(folder, repo_root)
+        for file in sorted(files):
+            path = file if relative_folder == '.' else os.path.join(relative_folder, file)
+            yield path.replace(os.sep, '/')
+
+
+def iter_repo_files(repo_root: Path, source: str) -> Iterable[str]:
+    if source == 'walk':
+        return iter_working_tree_files(repo_root)
+    # only pull in the git helpers when they are actually needed
+    try:
+        from .git import get_git_tracked_files
+    except ImportError:
+        from git import get_git_tracked_files
+    return get_git_tracked_files(repo_root)
+
+
+def chunked(items: Iterable[str], chunk_size: int) -> Iterator[List[str]]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def map_bounded(executor: Executor, function: Callable, items: Iterable, max_pending: int) -> Iterator:
+    """Like `executor.map`, but only submits up to `max_pending` items ahead of the results being consumed. `executor.map` submits every item up front, which would hold all the paths in a repository in memory at once."""
+    pending: Deque = deque()
+    for item in items:
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+        pending.append(executor.submit(function, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+# each worker process parses the rules once, when it starts, rather than receiving them with every chunk of paths
+_worker_codeowners: Optional[CompiledCodeOwners] = None
+
+
+def _init_audit_worker(codeowners_file: Path, codeowners_content: str) -> None:
+    global _worker_codeowners
+    _worker_codeowners = CompiledCodeOwners(parse_code_owners(codeowners_file, codeowners_content))
+
+
+def _audit_chunk(paths: List[str]) -> Tuple[int, Counter, List[str]]:
+    owner_totals = Counter()
+    unowned = list()
+    for path, codeowner in iter_resolved_code_owners(_worker_codeowners, paths):
+        if codeowner and codeowner.owners:
+            owner_totals.update(codeowner.owners)
+        else:
+            unowned.append(path)
+    return (len(paths), owner_totals, unowned)
+
+
+def audit(args: Namespace) -> None:
+    # imported here to keep start up time down for the commands which don't need multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    repo_root = Path(args.repo)
+    codeowners_file, codeowners_content = read_code_owners_file(repo_root, args.codeowners)
+
+    owner_totals = Counter()
+    unowned = list()
+    file_count = 0
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_audit_worker, initargs=(codeowners_file, codeowners_content)) as executor:
+        chunks = chunked(iter_repo_files(repo_root, args.source), args.chunk_size)
+        # enough to keep every worker busy while the results of the others are merged
+        for chunk_file_count, chunk_owner_totals, chunk_unowned in map_bounded(executor, _audit_chunk, chunks, 2 * (args.jobs or os.cpu_count() or 1)):
+            file_count += chunk_file_count
+            owner_totals.update(chunk_owner_totals)
+            unowned.extend(chunk_unowned)
+
+    if args.json:
+        json.dump({ 'files': file_count, 'owners': dict(owner_totals.most_common()), 'unowned': unowned }, sys.stdout, indent=2)
+        print()
+        return
+
+    print(f'{file_count} files')
+    for owner, total in owner_totals.most_common():
+        print(f'{total}\t{owner}')
+    print(f'\n{len(unowned)} unowned files:')
+    for path in unowned:
+        print(path)
+
+
+def iter_separated_paths(stream: BinaryIO, separator: bytes) -> Iterator[str]:
+    """Yield each path as soon as its separator has been read, without waiting for the rest of the stream."""
+    pending = b''
+    while True:
+        data = stream.read1(65536)
+        if not data:
+            break
+        *paths, pending = (pending + data).split(separator)
+        for path in paths:
+            if path:
+                yield os.fsdecode(path.rstrip(b'\r') if separator == b'\n' else path)
+    if pending:
+        yield os.fsdecode(pending)
+
+
+def resolve(args: Namespace, input_stream: Optional[BinaryIO] = None, output_stream: Optional[TextIO] = None) -> None:
+    input_stream = input_stream or sys.stdin.buffer
+    output_stream = output_stream or sys.stdout
+    if args.revision:
+        with open_git_cat_file(Path(args.repo)) as cat_file:
+            codeowners = load_code_owners_at_revision(cat_file, args.revision)
+    else:
+        codeowners_file, codeowners_content = read_code_owners_file(Path(args.repo), args.codeowners)
+        codeowners = CompiledCodeOwners(parse_code_owners(codeowners_file, codeowners_content))
+
+    separator = b'\0' if args.null else b'\n'
+    terminator = '\0' if args.null else '\n'
+    for path, codeowner in iter_resolved_code_owners(codeowners, iter_separated_paths(input_stream, separator)):
+        if codeowner:
+            output_stream.write(f'{path}\t{" ".join(codeowner.owners)}\t{codeowner.line_number}{terminator}')
+        else:
+            output_stream.write(f'{path}\t\t{terminator}')
+        # results are streamed, so that whatever is reading them doesn't have to wait for all input to be processed
+        output_stream.flush()
+
+
+def show_ownership_diff(args: Namespace) -> None:
+    repo_root = Path(args.repo)
+    with open_git_cat_file(repo_root) as cat_file:
+        old_codeowners = load_code_owners_at_revision(cat_file, args.old)
+        new_codeowners = load_code_owners_at_revision(cat_file, args.new) if args.new else None
+    if new_codeowners is None:
+        codeowners_file, codeowners_content = read_code_owners_file(repo_root, None)
+        new_codeowners = CompiledCodeOwners(parse_code_owners(codeowners_file, codeowners_content))
+
+    for change in diff_ownership(old_codeowners, new_codeowners, iter_repo_files(repo_root, args.source)):
+        old_owners = ' '.join(change.old_owner.owners) if change.old_owner else ''
+        new_owners = ' '.join(change.new_owner.owners) if change.new_owner else ''
+        print(f'{change.path}\t{old_owners}\t{new_owners}')
+
+
+def show_dead_rules(args: Namespace) -> None:
+    repo_root = Path(args.repo)
+    codeowners_file, codeowners_content = read_code_owners_file(repo_root, args.codeowners)
+    codeowners = CompiledCodeOwners(parse_code_owners(codeowners_file, codeowners_content))
+    if args.covered_only:
+        dead_rules = find_covered_rules(codeowners.specifications)
+    else:
+        paths = iter(iter_repo_files(repo_root, args.source))
+        first_path = next(paths, None)
+        if first_path is None:
+            # every rule would be unmatched, and pruning would leave nothing
+            raise SystemExit(f'No files found in {repo_root}')
+        dead_rules = find_dead_rules(codeowners, chain((first_path,), paths))
+
+    if args.prune:
+        dead_line_numbers = {dead_rule.specification.line_number for dead_rule in dead_rules}
+        # keep comments and blank lines, so that the pruned file can be diffed against the original
+        lines = codeowners_content.splitlines(keepends=True)
+        args.prune.write_text(''.join(line for line_number, line in enumerate(lines, 1) if line_number not in dead_line_numbers), encoding='utf-8')
+
+    if args.json:
+        json.dump([{
+            'line': dead_rule.specification.line_number,
+            'pattern': dead_rule.specification.glob_pattern,
+            'owners': list(dead_rule.specification.owners),
+            'reason': dead_rule.reason,
+            'shadowed_by': dead_rule.shadowed_by.line_number if dead_rule.shadowed_by else None,
+        } for dead_rule in dead_rules], sys.stdout, indent=2)
+        print()
+        return
+
+    for dead_rule in dead_rules:
+        shadowed_by = f'\tline {dead_rule.shadowed_by.line_number}: {dead_rule.shadowed_by.glob_pattern}' if dead_rule.shadowed_by else ''
+        print(f'{codeowners_file}:{dead_rule.specification.line_number}\t{dead_rule.reason}\t{dead_rule.specification.glob_pattern}{shadowed_by}')
+
+
+def show_history(args: Namespace) -> None:
+    try:
+        from .git import stream_git_log_changed_files
+    except ImportError:
+        from git import stream_git_log_changed_files
+
+    repo_root = Path(args.repo)
+    codeowners_file, codeowners_content = read_code_owners_file(repo_root, args.codeowners)
+    history = OwnershipHistory(parse_code_owners(codeowners_file, codeowners_content), args.path_cache_size, args.top)
+    log_args = [args.revision, '--no-merges']
+    if args.max_count:
+        log_args.append(f'--max-count={args.max_count}')
+    if args.since:
+        log_args.append(f'--since={args.since}')
+    for commit, paths in stream_git_log_changed_files(repo_root, *log_args, '--'):
+        history.add_commit(commit, paths)
+
+    owners = [{
+        'owner': owner,
+        'commits': commit_count,
+        'file_changes': history.file_changes_by_owner[owner],
+    } for owner, commit_count in history.commits_by_owner.most_common()]
+    if args.json:
+        json.dump({
+            'commits': history.commit_count,
+            'file_changes': history.file_change_count,
+            'unowned_file_changes': history.unowned_file_change_count,
+            'owners': owners,
+            'widest_commits': [{ 'commit': commit, 'owners': owner_count } for commit, owner_count in history.get_widest_commits()],
+        }, sys.stdout, indent=2)
+        print()
+        return
+
+    print(f'{history.commit_count} commits changing {history.file_change_count} files, {history.unowned_file_change_count} of them unowned')
+    print(f'owners per commit: {history.owners_per_commit.describe()}')
+    print(f'files per commit: {history.files_per_commit.describe()}')
+    print('\ncommits\tfiles\towner')
+    for owner in owners:
+        print(f'{owner["commits"]}\t{owner["file_changes"]}\t{owner["owner"]}')
+    print('\ncommits with the most owners:')
+    for commit, owner_count in history.get_widest_commits():
+        print(f'{commit}\t{owner_count}')
+
+
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser(prog='python -m cli', description='Resolve code owners from a GitHub CODEOWNERS file.')
+    sub_parsers = parser.add_subparsers(dest='command', required=True)
+
+    audit_parser = sub_parsers.add_parser('audit', help='Summarize ownership of every file in a repository, and list the unowned files.')
+    audit_parser.add_argument('repo', nargs='?', default='.', help='repository root (default: current folder)')
+    audit_parser.add_argument('--codeowners', type=Path, help='CODEOWNERS file to use (default: found the same way as GitHub does)')
+    audit_parser.add_argument('--source', choices=['git', 'walk'], default='git', help='list files with `git ls-files` or by walking the working tree (default: git)')
+    audit_parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='number of worker processes (default: number of CPUs)')
+    audit_parser.add_argument('--chunk-size', type=int, default=5000, help='number of paths sent to a worker at a time (default: 5000)')
+    audit_parser.add_argument('--json', action='store_true', help='output JSON instead of text')
+    audit_parser.set_defaults(func=audit)
+
+    resolve_parser = sub_parsers.add_parser('resolve', help='Read repository relative paths from stdin, and write `path<TAB>owners<TAB>line` for each to stdout as it is resolved.')
+    resolve_parser.add_argument('--repo', default='.', help='repository root, used to find the CODEOWNERS file (default: current folder)')
+    resolve_parser.add_argument('--codeowners', type=Path, help='CODEOWNERS file to use (default: found the same way as GitHub does)')
+    resolve_parser.add_argument('--revision', help='use the CODEOWNERS file as of this git revision, instead of the one in the working tree')
+    resolve_parser.add_argument('-z', '--null', action='store_true', help='paths are separated by NUL characters instead of newlines, i.e. from `git diff --name-only -z`, and output records are NUL terminated')
+    resolve_parser.set_defaults(func=resolve)
+
+    diff_parser = sub_parsers.add_parser('diff-ownership', help='List the files whose owners differ between two versions of CODEOWNERS, as `path<TAB>old owners<TAB>new owners`.')
+    diff_parser.add_argument('--repo', default='.', help='repository root (default: current folder)')
+    diff_parser.add_argument('--old', required=True, help='git revision to take the old CODEOWNERS file from, i.e. the merge base')
+    diff_parser.add_argument('--new', help='git revision to take the new CODEOWNERS file from (default: the working tree)')
+    diff_parser.add_argument('--source', choices=['git', 'walk'], default='git', help='list files with `git ls-files` or by walking the working tree (default: git)')
+    diff_parser.set_defaults(func=show_ownership_diff)
+
+    dead_rules_parser = sub_parsers.add_parser('dead-rules', help='List the rules which never decide the owners of a file, with their line numbers and why.')
+    dead_rules_parser.add_argument('repo', nargs='?', default='.', help='repository root (default: current folder)')
+    dead_rules_parser.add_argument('--codeowners', type=Path, help='CODEOWNERS file to use (default: found the same way as GitHub does)')
+    dead_rules_parser.add_argument('--source', choices=['git', 'walk'], default='git', help='list files with `git ls-files` or by walking the working tree (default: git)')
+    dead_rules_parser.add_argument('--covered-only', action='store_true', help="only list the rules which can't win for any file, without looking at the repository's files")
+    dead_rules_parser.add_argument('--prune', type=Path, metavar='OUTPUT', help='also write the CODEOWNERS file without the listed rules to OUTPUT')
+    dead_rules_parser.add_argument('--json', action='store_true', help='output JSON instead of text')
+    dead_rules_parser.set_defaults(func=show_dead_rules)
+
+    history_parser = sub_parsers.add_parser('history', help='Count how many commits and file changes in the git history each owner was pulled into, according to the current CODEOWNERS file.')
+    history_parser.add_argument('repo', nargs='?', default='.', help='repository root (default: current folder)')
+    history_parser.add_argument('--codeowners', type=Path, help='CODEOWNERS file to use (default: found the same way as GitHub does)')
+    history_parser.add_argument('--revision', default='HEAD', help='revision or range to read the history of, i.e. `main~1000..main` (default: HEAD)')
+    history_parser.add_argument('-n', '--max-count', type=int, help='only read this many of the most recent commits')
+    history_parser.add_argument('--since', help='only read commits more recent than this date, i.e. `3 months ago`')
+    history_parser.add_argument('--top', type=int, default=10, help='how many of the commits with the most owners to list (default: 10)')
+    history_parser.add_argument('--path-cache-size', type=int, default=65536, help='how many paths to remember the owners of (default: 65536)')
+    history_parser.add_argument('--json', action='store_true', help='output JSON instead of text')
+    history_parser.set_defaults(func=show_history)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = create_parser().parse_args(argv)
+    try:
+        args.func(args)
+    except CalledProcessError as e:
+        # i.e. not a git repository, which shouldn't look like one without any files
+        raise SystemExit(f'{" ".join(e.cmd)} failed: {(e.stderr or "").strip()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,44 @@
-from collections import deque
+from bisect import bisect_right
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache
 from pathlib import Path
-from typing import Iterable, Optional, Union
-from dataclasses import dataclass
-from wcmatch.glob import globmatch, GLOBSTAR
+from typing import TYPE_CHECKING, Dict, FrozenSet, Iterable, Iterator, List, Optional, Pattern, Sequence, Set, Tuple, TypeVar, Union
+from dataclasses import dataclass, replace
+from difflib import SequenceMatcher
+from wcmatch import __version__ as wcmatch_version
+from wcmatch.glob import globmatch, translate, GLOBSTAR
+import hashlib
+import heapq
+import itertools
+import marshal
+import mmap
+import os
+import re
+import sys
+import threading
+import time
+
+try:
+    from .instrumentation import Histogram, stats
+except ImportError:
+    from instrumentation import Histogram, stats
+
+if TYPE_CHECKING:
+    # only for annotations - the git helpers aren't needed to parse and resolve rules
+    try:
+        from .git import GitCatFile
+    except ImportError:
+        from git import GitCatFile
 
 # https://docs.github.com/en/repositories/managing-your-repositorys-settings-and-features/customizing-your-repository/about-code-owners
 
-def does_codeowner_glob_match(glob_pattern: str, path: Path) -> bool:
+def expand_codeowner_glob(glob_pattern: str) -> List[str]:
+    """Expand a CODEOWNERS pattern into the wcmatch glob patterns which together give it GitHub's semantics."""
     patterns_to_try = list()
     if glob_pattern.endswith('/'):
         patterns_to_try.append(glob_pattern + '**')
-    elif glob_pattern == '*':
-        return True
+        if not glob_pattern.startswith('/'):
+            patterns_to_try.append('**/' + glob_pattern + '**')
     elif glob_pattern.startswith('*.') and '/' not in glob_pattern:
         patterns_to_try.append('**/' + glob_pattern)
     else:
@@ -24,28 +51,185 @@ def does_codeowner_glob_match(glob_pattern: str, path: Path) -> bool:
         if not glob_pattern.startswith('/'):
             for pattern in list(patterns_to_try):
                 patterns_to_try.append('**/' + pattern)
-                
 
-    return globmatch(filename=str(path), patterns=patterns_to_try, flags=GLOBSTAR)
+    return patterns_to_try
+
+
+def translate_codeowner_glob(glob_pattern: str) -> str:
+    """Translate a CODEOWNERS pattern into a single regular expression source, to be used with `fullmatch`."""
+    if glob_pattern == '*':
+        return '(?s:.*)'
+    include, _ = translate(expand_codeowner_glob(glob_pattern), flags=GLOBSTAR)
+    return '|'.join(f'(?:{regex})' for regex in include)
+
+
+@lru_cache(maxsize=None)
+def compile_codeowner_glob(glob_pattern: str) -> Pattern:
+    return re.compile(translate_codeowner_glob(glob_pattern))
+
+
+def does_codeowner_glob_match(glob_pattern: str, path: Path) -> bool:
+    return compile_codeowner_glob(glob_pattern).fullmatch(str(path)) is not None
+
+
+# wcmatch follows the case sensitivity of the platform's file system, so the index keys must too
+_IGNORE_CASE = globmatch('A', 'a', flags=GLOBSTAR)
+_PATH_SEPARATORS = re.compile(r'[\\/]' if sys.platform == 'win32' else '/')
+_GLOB_CHARACTERS = frozenset('*?[\\')
+
+
+def _normalize_key(text: str) -> str:
+    return text.casefold() if _IGNORE_CASE else text
+
+
+def _is_literal_component(component: str) -> bool:
+    return component not in ('.', '..') and _GLOB_CHARACTERS.isdisjoint(component)
+
+
+def split_path_components(path: str) -> Tuple[bool, List[str]]:
+    """Split a path into whether it is anchored at the root, and its (index key normalized) components."""
+    components = [_normalize_key(component) for component in _PATH_SEPARATORS.split(path) if component]
+    return (_PATH_SEPARATORS.match(path) is not None, components)
+
+
+def anchor_path(path: Union[str, Path]) -> str:
+    """A repository relative path as the rules are matched against it: starting with a slash, which anchored patterns like `/docs/` need, whether or not it was given with one (`git` never outputs one)."""
+    path_str = str(path)
+    return path_str if _PATH_SEPARATORS.match(path_str) else '/' + path_str
+
+
+class _TrieNode:
+    __slots__ = ('children', 'rule_indexes')
+
+    def __init__(self):
+        self.children: Dict[str, _TrieNode] = dict()
+        self.rule_indexes: List[int] = list()
+
+
+class CodeOwnersIndex:
+    """Buckets the rules of a CODEOWNERS file by the literal parts of their patterns, so that only the rules which could possibly match a path need to be tested against it.
+
+    - patterns anchored at the root with literal leading folders (i.e. `/build/logs/`) live in a trie of path components
+    - unanchored patterns with a literal first folder (i.e. `apps/`, `docs/*` or `**/logs`) are keyed by that folder name, which can appear at any depth
+    - extension patterns (i.e. `*.js`) are keyed by the extension
+    - everything else is a true wildcard, which is always a candidate
+    """
+
+    def __init__(self, glob_patterns: Iterable[str]):
+        self.root = _TrieNode()
+        self.by_component: Dict[str, List[int]] = dict()
+        self.by_extension: Dict[str, List[int]] = dict()
+        self.fallback: List[int] = list()
+        for rule_index, glob_pattern in enumerate(glob_patterns):
+            self._add(rule_index, glob_pattern)
+
+    def _add(self, rule_index: int, glob_pattern: str) -> None:
+        if glob_pattern.startswith('*.') and '/' not in glob_pattern and _GLOB_CHARACTERS.isdisjoint(glob_pattern[2:]):
+            self.by_extension.setdefault(_normalize_key(glob_pattern[2:]), []).append(rule_index)
+            return
+
+        # unlike paths, patterns only use forward slashes - a backslash is an escape character
+        anchored = glob_pattern.startswith('/')
+        components = [_normalize_key(component) for component in glob_pattern.split('/') if component]
+        # a leading globstar (i.e. `**/logs`) just means the literal folders which follow it can be at any depth
+        while components and components[0] == '**':
+            components.pop(0)
+            anchored = False
+        literal_components = list()
+        for component in components:
+            if not _is_literal_component(component):
+                break
+            literal_components.append(component)
+
+        if not literal_components or glob_pattern == '*':
+            self.fallback.append(rule_index)
+        elif anchored:
+            node = self.root
+            for component in literal_components:
+                node = node.children.setdefault(component, _TrieNode())
+            node.rule_indexes.append(rule_index)
+        else:
+            self.by_component.setdefault(literal_components[0], []).append(rule_index)
+
+    def get_folder_candidates(self, anchored: bool, folder_components: List[str]) -> Tuple[Set[int], Optional[_TrieNode]]:
+        """The candidate rules contributed by the folders of a path, and the trie node reached, to be shared by every file in that folder."""
+        candidates = set(self.fallback)
+        node = self.root if anchored else None
+        for component in folder_components:
+            if node is not None:
+                node = node.children.get(component)
+                if node is not None:
+                    candidates.update(node.rule_indexes)
+            rule_indexes = self.by_component.get(component)
+            if rule_indexes:
+                candidates.update(rule_indexes)
+        return (candidates, node)
+
+    def get_file_candidates(self, folder_node: Optional[_TrieNode], file_name: str) -> Set[int]:
+        """The candidate rules contributed by the file name of a path, given the trie node reached by its folders."""
+        candidates = set()
+        if folder_node is not None:
+            node = folder_node.children.get(file_name)
+            if node is not None:
+                candidates.update(node.rule_indexes)
+
+        rule_indexes = self.by_component.get(file_name)
+        if rule_indexes:
+            candidates.update(rule_indexes)
+
+        dot_pos = file_name.find('.')
+        while dot_pos > -1:
+            rule_indexes = self.by_extension.get(file_name[dot_pos + 1:])
+            if rule_indexes:
+                candidates.update(rule_indexes)
+            dot_pos = file_name.find('.', dot_pos + 1)
+
+        return candidates
+
+    def get_candidates(self, path: str) -> Set[int]:
+        """The indexes of the rules which could match the given path, in no particular order."""
+        anchored, components = split_path_components(path)
+        if not components:
+            return set(self.fallback)
+        candidates, folder_node = self.get_folder_candidates(anchored, components[:-1])
+        return candidates | self.get_file_candidates(folder_node, components[-1])
+
 
 @dataclass
 class CodeOwnerSpecification:
-    """Data class for showing the code owner specification parsed from a line in a CODEOWNERS file."""
+    """Data class for showing the code owner specification parsed from a line in a CODEOWNERS file.
+
+    There can be many thousands of these per rule set, so they are slotted, and the parser shares `owners` tuples, `nearest_comment` strings and `codeowners_file_path` between them.
+    """
+    __slots__ = ('nearest_comment', 'glob_pattern', 'owners', 'line_number', 'codeowners_file_path')
     nearest_comment: Optional[str]
     glob_pattern: str
-    owners: list #[str]
+    owners: Tuple[str, ...]
     line_number: int
     codeowners_file_path: Path
 
     def does_match(self, path: Path) -> bool:
-        return does_codeowner_glob_match(self.glob_pattern, path)
+        return does_codeowner_glob_match(self.glob_pattern, anchor_path(path))
+
+
+# the same handful of owners appear on many rules, so every rule set shares a single tuple per combination of them
+_interned_owners: Dict[Tuple[str, ...], Tuple[str, ...]] = dict()
+
+
+def intern_owners(owners: Iterable[str]) -> Tuple[str, ...]:
+    owners = tuple(sys.intern(owner) for owner in owners)
+    return _interned_owners.setdefault(owners, owners)
 
 
 def parse_code_owners(codeowners_file_path: Path, codeowners_content: str) -> Iterable[CodeOwnerSpecification]:
+    return parse_code_owners_lines(codeowners_file_path, codeowners_content.splitlines())
+
+
+def parse_code_owners_lines(codeowners_file_path: Path, lines: Iterable[str], first_line_number: int = 1) -> Iterable[CodeOwnerSpecification]:
     last_comment = None
-    line_number = 0
+    line_number = first_line_number - 1
     prev_line_was_a_rule = False
-    for line in codeowners_content.splitlines():
+    for line in lines:
         line_number += 1
         if line.startswith('#'):
             if last_comment is None or prev_line_was_a_rule:
@@ -68,15 +252,258 @@ def parse_code_owners(codeowners_file_path: Path, codeowners_content: str) -> It
         space_pos = line.find(' ')
         if space_pos == -1:
             glob_pattern = line
-            owners = []
+            owners = ()
         else:
             glob_pattern = line[0:space_pos]
-            owners = line[space_pos:].lstrip().split()
+            owners = intern_owners(line[space_pos:].lstrip().split())
         
         yield CodeOwnerSpecification(last_comment, glob_pattern, owners, line_number, codeowners_file_path)
 
 
+class RuleMatchers:
+    """The compiled matcher for each rule of a rule set, indexed like the rules.
+
+    Compiling the regular expressions is the most expensive part of loading a CODEOWNERS file, so each one is only compiled the first time it is needed - thanks to the index, most rules are never even candidates for the files which get looked up.
+    When the regular expression source is already known (i.e. from the on-disk cache), it is used instead of translating the glob pattern again.
+    """
+
+    __slots__ = ('glob_patterns', 'regex_sources', 'compiled')
+
+    def __init__(self, glob_patterns: List[str], regex_sources: Optional[List[Optional[str]]] = None, compiled: Optional[List[Optional[Pattern]]] = None):
+        self.glob_patterns = glob_patterns
+        self.regex_sources = regex_sources if regex_sources is not None else [None] * len(glob_patterns)
+        self.compiled = compiled if compiled is not None else [None] * len(glob_patterns)
+
+    def __len__(self) -> int:
+        return len(self.glob_patterns)
+
+    def __getitem__(self, index: int) -> Pattern:
+        matcher = self.compiled[index]
+        if matcher is None:
+            regex_source = self.regex_sources[index]
+            stats.increment('rules compiled')
+            if regex_source is None:
+                matcher = compile_codeowner_glob(self.glob_patterns[index])
+            else:
+                matcher = re.compile(regex_source)
+            self.compiled[index] = matcher
+        return matcher
+
+    def __iter__(self) -> Iterator[Pattern]:
+        for index in range(len(self.glob_patterns)):
+            yield self[index]
+
+    def get_regex_source(self, index: int) -> str:
+        regex_source = self.regex_sources[index]
+        if regex_source is None:
+            matcher = self.compiled[index]
+            regex_source = matcher.pattern if matcher is not None else translate_codeowner_glob(self.glob_patterns[index])
+            # so that it isn't translated again, i.e. when the rules are saved to the cache, or carried over by an incremental reparse
+            self.regex_sources[index] = regex_source
+        return regex_source
+
+
+# how many rules go into each combined regular expression - compiling one huge alternation is slow, and gains little as a failed match tries every alternative anyway
+COMBINED_CHUNK_SIZE = 200
+
+
+class CombinedMatcher:
+    """The regular expressions of several rules merged into alternations, so that one `re` call per chunk finds the last of the rules to match a path, rather than one call per rule.
+
+    Alternatives are tried in order and the first one to match wins, so the rules are added from the highest index down.
+    Each alternative ends with an empty group, which tells which one matched: unlike a group around the whole alternative, it costs nothing when the alternative fails, which is nearly always.
+    """
+
+    __slots__ = ('chunks',)
+
+    def __init__(self, rule_indexes: Iterable[int], regex_sources: Iterable[str], chunk_size: int = COMBINED_CHUNK_SIZE):
+        rules = sorted(zip(rule_indexes, regex_sources), reverse=True)
+        # each chunk, with the rule index for each of its group numbers
+        self.chunks: List[Tuple[Pattern, List[int]]] = list()
+        for start in range(0, len(rules), chunk_size):
+            chunk_rules = rules[start:start + chunk_size]
+            chunk = re.compile('|'.join(f'(?:{regex_source})()' for _, regex_source in chunk_rules))
+            rule_by_group = [-1]
+            if chunk.groups == len(chunk_rules):
+                rule_by_group.extend(rule_index for rule_index, _ in chunk_rules)
+            else: # some sources have groups of their own, which come before the empty group
+                for rule_index, regex_source in chunk_rules:
+                    rule_by_group.extend([-1] * re.compile(regex_source).groups)
+                    rule_by_group.append(rule_index)
+            self.chunks.append((chunk, rule_by_group))
+
+    def match(self, path_str: str) -> int:
+        """The index of the last rule matching the path, or -1 if none do."""
+        for chunk, rule_by_group in self.chunks:
+            match = chunk.fullmatch(path_str)
+            if match:
+                return rule_by_group[match.lastindex]
+        return -1
+
+
+# the fewest always-candidate wildcard rules for which matching them with a `CombinedMatcher` is worth it
+COMBINED_FALLBACK_MIN_RULES = 8
+
+
+class CompiledCodeOwners:
+    """The specifications parsed from a CODEOWNERS file, with their glob patterns compiled so that resolving a path only runs regular expressions."""
+
+    def __init__(self, specifications: Iterable[CodeOwnerSpecification], matchers: Optional[RuleMatchers] = None):
+        self.specifications = list(specifications)
+        self.matchers = matchers if matchers is not None else RuleMatchers([specification.glob_pattern for specification in self.specifications])
+        self.index = CodeOwnersIndex(specification.glob_pattern for specification in self.specifications)
+        self._rules_by_owner: Optional[Dict[str, List[int]]] = None
+        self._owner_names: Dict[str, str] = dict()
+        # the wildcard rules the index can't narrow down are candidates for every path, so with enough of them they are matched all at once
+        self.fallback_rules: FrozenSet[int] = frozenset(self.index.fallback) if len(self.index.fallback) >= COMBINED_FALLBACK_MIN_RULES else frozenset()
+        self._fallback_matcher: Optional[CombinedMatcher] = None
+
+    def __iter__(self) -> Iterator[CodeOwnerSpecification]:
+        return iter(self.specifications)
+
+    def __len__(self) -> int:
+        return len(self.specifications)
+
+    def __getitem__(self, index: int) -> CodeOwnerSpecification:
+        return self.specifications[index]
+
+    def get_matching(self, path: Path) -> Iterable[CodeOwnerSpecification]:
+        path_str = anchor_path(path)
+        for index in sorted(self.index.get_candidates(path_str)):
+            if self.matchers[index].fullmatch(path_str):
+                yield self.specifications[index]
+
+    def resolve(self, path: Path) -> Optional[CodeOwnerSpecification]:
+        path_str = anchor_path(path)
+        return self.resolve_from_candidates(path_str, self.index.get_candidates(path_str))
+
+    def get_rules_by_owner(self) -> Dict[str, List[int]]:
+        """The indexes of the rules naming each owner, keyed by the owner in lower case as GitHub ignores case in user and team names. Built the first time it is needed."""
+        if self._rules_by_owner is None:
+            rules_by_owner: Dict[str, List[int]] = dict()
+            for index, specification in enumerate(self.specifications):
+                for owner in specification.owners:
+                    key = owner.lower()
+                    if key not in rules_by_owner:
+                        rules_by_owner[key] = list()
+                        self._owner_names[key] = owner
+                    rules_by_owner[key].append(index)
+            self._rules_by_owner = rules_by_owner
+        return self._rules_by_owner
+
+    def get_owners(self) -> List[str]:
+        """Every owner named by the rules, as first written, in the order they first appear."""
+        self.get_rules_by_owner()
+        return list(self._owner_names.values())
+
+    def get_rules_for_owner(self, owner: str) -> List[CodeOwnerSpecification]:
+        return [self.specifications[index] for index in self.get_rules_by_owner().get(owner.lower(), ())]
+
+    def resolve_from_candidates(self, path_str: str, candidates: Set[int]) -> Optional[CodeOwnerSpecification]:
+        # the last matching pattern takes precedence, so look from the bottom and stop at the first match
+        fallback_rules = self.fallback_rules
+        # the last of the wildcard rules to match, found all at once when the first of them is reached
+        fallback_match: Optional[int] = None
+        evaluated = 0
+        for index in sorted(candidates, reverse=True):
+            if index in fallback_rules:
+                if fallback_match is None:
+                    fallback_match = self.get_fallback_matcher().match(path_str)
+                if index <= fallback_match:
+                    break
+                continue
+            if fallback_match is not None and index < fallback_match:
+                break
+            evaluated += 1
+            if self.matchers[index].fullmatch(path_str):
+                stats.record_size('rules evaluated per lookup', evaluated)
+                return self.specifications[index]
+        stats.record_size('rules evaluated per lookup', evaluated)
+        return self.specifications[fallback_match] if fallback_match is not None and fallback_match >= 0 else None
+
+    def get_fallback_matcher(self) -> CombinedMatcher:
+        if self._fallback_matcher is None:
+            fallback_rules = sorted(self.fallback_rules)
+            self._fallback_matcher = CombinedMatcher(fallback_rules, [self.matchers.get_regex_source(index) for index in fallback_rules])
+        return self._fallback_matcher
+
+
+def find_changed_lines(old_content: str, new_content: str) -> Optional[Tuple[int, int, int]]:
+    """Compare two versions of a CODEOWNERS file, returning `(first_line, old_last_line, new_last_line)` such that lines `first_line` to `old_last_line` of the old content were replaced by lines `first_line` to `new_last_line` of the new content, or None if they are the same.
+
+    Pure insertions have `old_last_line == first_line - 1`, and pure deletions have `new_last_line == first_line - 1`.
+    """
+    old_lines = old_content.splitlines()
+    new_lines = new_content.splitlines()
+    if old_lines == new_lines:
+        return None
+
+    common_prefix = 0
+    for old_line, new_line in zip(old_lines, new_lines):
+        if old_line != new_line:
+            break
+        common_prefix += 1
+
+    common_suffix = 0
+    max_suffix = min(len(old_lines), len(new_lines)) - common_prefix
+    while common_suffix < max_suffix and old_lines[-1 - common_suffix] == new_lines[-1 - common_suffix]:
+        common_suffix += 1
+
+    return (common_prefix + 1, len(old_lines) - common_suffix, len(new_lines) - common_suffix)
+
+
+def _is_blank_line(line: str) -> bool:
+    return line.strip() == ''
+
+
+def reparse_code_owners(previous: CompiledCodeOwners, codeowners_file_path: Path, codeowners_content: str, first_line: int, old_last_line: int, new_last_line: int) -> CompiledCodeOwners:
+    """Update a compiled rule set after lines `first_line` to `old_last_line` of the CODEOWNERS file were replaced by lines `first_line` to `new_last_line` in `codeowners_content`.
+
+    Only the blocks (runs of lines between blank lines) touched by the change are parsed again, because a rule's `nearest_comment` comes from the comments above it in the same block.
+    Rules outside of those blocks keep their compiled matchers, and have their line numbers shifted if needed.
+    """
+    lines = codeowners_content.splitlines()
+    line_delta = new_last_line - old_last_line
+
+    # parse from the blank line before the change, where the parser state is reset, to the blank line after it
+    start = first_line - 1
+    while start > 0 and not _is_blank_line(lines[start - 1]):
+        start -= 1
+    end = max(new_last_line, start)
+    while end < len(lines) and not _is_blank_line(lines[end]):
+        end += 1
+    old_end = end - line_delta
+
+    specifications = list()
+    regex_sources = list()
+    compiled = list()
+    previous_matchers = previous.matchers
+    for index, specification in enumerate(previous.specifications):
+        if specification.line_number > start:
+            break
+        specifications.append(specification)
+        regex_sources.append(previous_matchers.regex_sources[index])
+        compiled.append(previous_matchers.compiled[index])
+
+    for specification in parse_code_owners_lines(codeowners_file_path, lines[start:end], start + 1):
+        specifications.append(specification)
+        regex_sources.append(None)
+        compiled.append(None)
+
+    for index, specification in enumerate(previous.specifications):
+        if specification.line_number > old_end:
+            specifications.append(replace(specification, line_number=specification.line_number + line_delta) if line_delta else specification)
+            regex_sources.append(previous_matchers.regex_sources[index])
+            compiled.append(previous_matchers.compiled[index])
+
+    glob_patterns = [specification.glob_pattern for specification in specifications]
+    return CompiledCodeOwners(specifications, RuleMatchers(glob_patterns, regex_sources, compiled))
+
+
 def get_matching_code_owner_specifications_for_file(codeowners: Iterable[CodeOwnerSpecification], path: Path) -> Iterable[CodeOwnerSpecification]:
+    if isinstance(codeowners, CompiledCodeOwners):
+        yield from codeowners.get_matching(path)
+        return
     for owner_specification in codeowners:
         if owner_specification.does_match(path):
             yield owner_specification
@@ -84,7 +511,15 @@ def get_matching_code_owner_specifications_for_file(codeowners: Iterable[CodeOwn
 
 def get_resolved_code_owners_for_file(codeowners: Iterable[CodeOwnerSpecification], path: Path) -> Optional[CodeOwnerSpecification]:
     # TODO: option to skip * root entry
-    
+    if isinstance(codeowners, CompiledCodeOwners):
+        return codeowners.resolve(path)
+    if isinstance(codeowners, Sequence):
+        for owner_specification in reversed(codeowners):
+            if owner_specification.does_match(path):
+                return owner_specification
+        return None
+
+    # an arbitrary iterable (i.e. straight from `parse_code_owners`) can only be consumed forwards
     queue = deque(get_matching_code_owner_specifications_for_file(codeowners, path), maxlen=1)
     if queue:
         last_element = queue.pop()
@@ -93,13 +528,557 @@ def get_resolved_code_owners_for_file(codeowners: Iterable[CodeOwnerSpecificatio
     return None
 
 
+PathLike = TypeVar('PathLike', str, Path)
+
+
+def iter_resolved_code_owners(codeowners: Iterable[CodeOwnerSpecification], paths: Iterable[PathLike]) -> Iterator[Tuple[PathLike, Optional[CodeOwnerSpecification]]]:
+    """Resolve the code owner for each of the given repository relative paths (with or without a leading slash), as a stream.
+
+    Consecutive paths in the same folder share the candidate rules found for that folder, so this is most efficient when the paths are grouped by folder - as they are in `git` output.
+    """
+    if not isinstance(codeowners, CompiledCodeOwners):
+        codeowners = CompiledCodeOwners(codeowners)
+    for path, path_str, candidates in _iter_candidates(codeowners.index, paths):
+        yield (path, codeowners.resolve_from_candidates(path_str, candidates))
+
+
+def _iter_candidates(index: CodeOwnersIndex, paths: Iterable[PathLike]) -> Iterator[Tuple[PathLike, str, Set[int]]]:
+    """The candidate rules for each path, sharing the work done for a folder with the paths which follow it in the same folder."""
+    previous_folder = None
+    folder_candidates: Set[int] = set()
+    folder_node = None
+    for path in paths:
+        path_str = anchor_path(path)
+        anchored, components = split_path_components(path_str)
+        if not components:
+            yield (path, path_str, set(index.fallback))
+            continue
+
+        folder = (anchored, components[:-1])
+        if folder != previous_folder:
+            folder_candidates, folder_node = index.get_folder_candidates(anchored, components[:-1])
+            previous_folder = folder
+        yield (path, path_str, folder_candidates | index.get_file_candidates(folder_node, components[-1]))
+
+
+def _folder_sort_key(path: PathLike) -> Tuple[bool, List[str], str]:
+    anchored, components = split_path_components(anchor_path(path))
+    return (anchored, components[:-1], components[-1] if components else '')
+
+
+def resolve_many(codeowners: Iterable[CodeOwnerSpecification], paths: Iterable[PathLike]) -> Dict[PathLike, Optional[CodeOwnerSpecification]]:
+    """Resolve the code owner for each of the given repository relative paths, grouping them by folder first so that work is shared between files in the same folder."""
+    return dict(iter_resolved_code_owners(codeowners, sorted(paths, key=_folder_sort_key)))
+
+
+class OwnershipMap:
+    """The rule which wins for each of a set of paths (i.e. every file tracked by git), grouped by rule, so that listing what an owner owns takes time proportional to the answer rather than resolving every path again."""
+
+    def __init__(self, codeowners: Iterable[CodeOwnerSpecification], paths: Iterable[PathLike]):
+        if not isinstance(codeowners, CompiledCodeOwners):
+            codeowners = CompiledCodeOwners(codeowners)
+        self.codeowners = codeowners
+        self.rule_by_path = resolve_many(codeowners, paths)
+        # the specifications are not hashable, but line numbers are unique within a rule set
+        self.paths_by_line_number: Dict[int, List[PathLike]] = dict()
+        self.unowned: List[PathLike] = list()
+        for path, specification in self.rule_by_path.items():
+            if specification is None or not specification.owners:
+                self.unowned.append(path)
+            else:
+                self.paths_by_line_number.setdefault(specification.line_number, list()).append(path)
+
+    def get_paths_for_rule(self, specification: CodeOwnerSpecification) -> List[PathLike]:
+        return self.paths_by_line_number.get(specification.line_number, [])
+
+    def get_paths_for_owner(self, owner: str) -> Iterator[Tuple[PathLike, CodeOwnerSpecification]]:
+        """The paths the given owner owns, with the rule which gives it them. Rules naming the owner which never win (i.e. they are overridden further down the file) contribute nothing."""
+        for specification in self.codeowners.get_rules_for_owner(owner):
+            for path in self.get_paths_for_rule(specification):
+                yield path, specification
+
+
+class OwnershipHistory:
+    """Per owner and per commit statistics over the changed files of a stream of commits (i.e. from `git log`), using memory proportional to the number of owners and distinct paths cached rather than to the number of commits.
+
+    The same files tend to change again and again, so the owners of each path are kept in an LRU cache rather than resolved every time.
+    """
+
+    def __init__(self, codeowners: Iterable[CodeOwnerSpecification], path_cache_size: int = 65536, widest_commit_count: int = 10):
+        if not isinstance(codeowners, CompiledCodeOwners):
+            codeowners = CompiledCodeOwners(codeowners)
+        self.codeowners = codeowners
+        self.owners_by_path = LRUCache(path_cache_size)
+        self.widest_commit_count = widest_commit_count
+        self.commit_count = 0
+        self.file_change_count = 0
+        self.unowned_file_change_count = 0
+        # how many commits changed a file the owner owns, i.e. how often they would have been asked to review
+        self.commits_by_owner: Counter = Counter()
+        self.file_changes_by_owner: Counter = Counter()
+        self.owners_per_commit = Histogram()
+        self.files_per_commit = Histogram()
+        # (owner count, commit) of the commits which needed the most owners, as a min heap so that the narrowest is the one replaced
+        self._widest_commits: List[Tuple[int, str]] = list()
+
+    def get_owners(self, path: PathLike) -> Tuple[str, ...]:
+        owners = self.owners_by_path.get(path)
+        if owners is None:
+            codeowner = self.codeowners.resolve(path)
+            owners = codeowner.owners if codeowner else ()
+            self.owners_by_path.put(path, owners)
+        return owners
+
+    def add_commit(self, commit: str, paths: Iterable[PathLike]) -> None:
+        owners: Set[str] = set()
+        file_count = 0
+        for path in paths:
+            file_count += 1
+            path_owners = self.get_owners(path)
+            if path_owners:
+                owners.update(path_owners)
+                self.file_changes_by_owner.update(path_owners)
+            else:
+                self.unowned_file_change_count += 1
+
+        self.commit_count += 1
+        self.file_change_count += file_count
+        self.commits_by_owner.update(owners)
+        self.owners_per_commit.record(len(owners))
+        self.files_per_commit.record(file_count)
+        if len(self._widest_commits) < self.widest_commit_count:
+            heapq.heappush(self._widest_commits, (len(owners), commit))
+        elif self._widest_commits and len(owners) > self._widest_commits[0][0]:
+            heapq.heapreplace(self._widest_commits, (len(owners), commit))
+
+    def get_widest_commits(self) -> List[Tuple[str, int]]:
+        """The commits which changed files with the most owners, with how many owners, most first."""
+        return [(commit, owner_count) for owner_count, commit in sorted(self._widest_commits, key=lambda item: -item[0])]
+
+
+@dataclass
+class DeadRule:
+    """A rule which never decides the owners of a file.
+
+    - `duplicate`: a later rule has the same pattern
+    - `covered`: a later rule matches everything it could match, i.e. `/apps/` after `/apps/web/`, or `*` after anything
+    - `shadowed`: it matches some of the given files, but a later rule always wins for them
+    - `unmatched`: it matches none of the given files
+
+    The first two hold for any file, the last two only for the files the rules were checked against.
+    """
+    specification: CodeOwnerSpecification
+    reason: str
+    shadowed_by: Optional[CodeOwnerSpecification] = None
+
+
+def _get_covered_folder(glob_pattern: str) -> Optional[Tuple[str, ...]]:
+    """The folder an anchored pattern like `/apps/` or `/apps/**` matches every file below, as its components."""
+    if not glob_pattern.startswith('/') or not glob_pattern.endswith(('/', '/**')):
+        return None
+    components = [_normalize_key(component) for component in glob_pattern.split('/') if component]
+    if components and components[-1] == '**':
+        components.pop()
+    if not components or not all(_is_literal_component(component) for component in components):
+        return None
+    return tuple(components)
+
+
+def _could_match_hidden_name(component: str) -> bool:
+    """Whether a pattern component could match a name starting with a dot, which globstars and wildcards never do (there is no `DOTGLOB`)."""
+    return component.startswith(('.', '[', '\\'))
+
+
+def find_covered_rules(codeowners: Sequence[CodeOwnerSpecification]) -> List[DeadRule]:
+    """The rules which can never win for any file, because a later rule has the same pattern or matches everything they could match, in file order.
+
+    This is deliberately conservative - only simple cases are recognized, so that everything reported is certain.
+    """
+    later_patterns: Dict[str, CodeOwnerSpecification] = dict()
+    covered_folders: Dict[Tuple[str, ...], CodeOwnerSpecification] = dict()
+    catch_all: Optional[CodeOwnerSpecification] = None
+    dead_rules = list()
+    for specification in reversed(codeowners):
+        glob_pattern = specification.glob_pattern
+        if catch_all is not None:
+            dead_rules.append(DeadRule(specification, 'covered', catch_all))
+            continue
+        if glob_pattern in later_patterns:
+            dead_rules.append(DeadRule(specification, 'duplicate', later_patterns[glob_pattern]))
+            continue
+        if glob_pattern.startswith('/') and covered_folders:
+            components = [_normalize_key(component) for component in glob_pattern.split('/') if component]
+            covering = None
+            # everything an anchored pattern matches is below its literal leading folders, so a folder rule for any of those covers it
+            for length in range(1, len(components)):
+                if not _is_literal_component(components[length - 1]):
+                    break
+                covering = covered_folders.get(tuple(components[:length]))
+                # `/apps/` doesn't match anything below i.e. `/apps/.config/`, but `/apps/.config/` itself would
+                if covering is not None and any(_could_match_hidden_name(component) for component in components[length:]):
+                    covering = None
+                if covering is not None:
+                    break
+            if covering is not None:
+                dead_rules.append(DeadRule(specification, 'covered', covering))
+                continue
+
+        # a rule which is itself dead can't cover anything that the rule covering it doesn't already
+        later_patterns[glob_pattern] = specification
+        # unlike `**`, a lone `*` matches hidden files too
+        if glob_pattern == '*':
+            catch_all = specification
+        folder = _get_covered_folder(glob_pattern)
+        if folder is not None:
+            covered_folders.setdefault(folder, specification)
+    dead_rules.reverse()
+    return dead_rules
+
+
+def find_dead_rules(codeowners: Iterable[CodeOwnerSpecification], paths: Iterable[PathLike]) -> List[DeadRule]:
+    """The rules which don't decide the owners of any of the given paths (i.e. every file tracked by git), as well as those which can't for any file, in file order.
+
+    The paths are checked in a single pass, only against the candidate rules from the index, and rules already known to match something are not tested again once a path's winner has been found.
+    """
+    if not isinstance(codeowners, CompiledCodeOwners):
+        codeowners = CompiledCodeOwners(codeowners)
+    covered = {dead_rule.specification.line_number: dead_rule for dead_rule in find_covered_rules(codeowners.specifications)}
+    covered_indexes = {index for index, specification in enumerate(codeowners.specifications) if specification.line_number in covered}
+    matchers = codeowners.matchers
+    winners: Set[int] = set()
+    matched: Set[int] = set()
+    for _, path_str, candidates in _iter_candidates(codeowners.index, sorted(paths, key=_folder_sort_key)):
+        won = False
+        # covered rules can never win, as the rule covering them comes later and so is tested first
+        for index in sorted(candidates - covered_indexes, reverse=True):
+            if won and index in matched:
+                continue
+            if matchers[index].fullmatch(path_str):
+                matched.add(index)
+                if not won:
+                    winners.add(index)
+                    won = True
+
+    dead_rules = list()
+    for index, specification in enumerate(codeowners.specifications):
+        if specification.line_number in covered:
+            dead_rules.append(covered[specification.line_number])
+        elif index not in winners:
+            dead_rules.append(DeadRule(specification, 'shadowed' if index in matched else 'unmatched'))
+    return dead_rules
+
+
+def prune_code_owners(codeowners: CompiledCodeOwners, dead_rules: Iterable[DeadRule]) -> CompiledCodeOwners:
+    """The rule set without the given dead rules, which resolves the same owners with fewer rules to check. Already compiled matchers are kept."""
+    dead_line_numbers = {dead_rule.specification.line_number for dead_rule in dead_rules}
+    kept = [index for index, specification in enumerate(codeowners.specifications) if specification.line_number not in dead_line_numbers]
+    matchers = codeowners.matchers
+    return CompiledCodeOwners(
+        [codeowners.specifications[index] for index in kept],
+        RuleMatchers(
+            [matchers.glob_patterns[index] for index in kept],
+            [matchers.regex_sources[index] for index in kept],
+            [matchers.compiled[index] for index in kept],
+        ),
+    )
+
+
+@dataclass
+class OwnershipChange:
+    """A path whose code owners differ between two versions of a CODEOWNERS file."""
+    path: Union[str, Path]
+    old_owner: Optional[CodeOwnerSpecification]
+    new_owner: Optional[CodeOwnerSpecification]
+
+
+def _owners_of(specification: Optional[CodeOwnerSpecification]) -> Tuple[str, ...]:
+    return specification.owners if specification else ()
+
+
+def get_changed_rules(old_codeowners: Sequence[CodeOwnerSpecification], new_codeowners: Sequence[CodeOwnerSpecification]) -> Tuple[List[CodeOwnerSpecification], List[CodeOwnerSpecification]]:
+    """The rules removed from, and added to, a CODEOWNERS file. Rules which only moved because of lines inserted or removed around them are not included, nor are rules whose comments changed."""
+    matcher = SequenceMatcher(
+        None,
+        [(specification.glob_pattern, specification.owners) for specification in old_codeowners],
+        [(specification.glob_pattern, specification.owners) for specification in new_codeowners],
+        autojunk=False,
+    )
+    removed = list()
+    added = list()
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag != 'equal':
+            removed.extend(old_codeowners[old_start:old_end])
+            added.extend(new_codeowners[new_start:new_end])
+    return (removed, added)
+
+
+def diff_ownership(old_codeowners: Iterable[CodeOwnerSpecification], new_codeowners: Iterable[CodeOwnerSpecification], paths: Iterable[PathLike]) -> Iterator[OwnershipChange]:
+    """Find the paths whose owners differ between two versions of a CODEOWNERS file.
+
+    Rules present in both versions, in the same relative order, resolve any path they match the same way in both; so only paths matched by a removed or added rule can change owner, and only those are resolved against the full rule sets.
+    """
+    if not isinstance(old_codeowners, CompiledCodeOwners):
+        old_codeowners = CompiledCodeOwners(old_codeowners)
+    if not isinstance(new_codeowners, CompiledCodeOwners):
+        new_codeowners = CompiledCodeOwners(new_codeowners)
+
+    removed, added = get_changed_rules(old_codeowners.specifications, new_codeowners.specifications)
+    if not removed and not added:
+        return
+    changed_rules = CompiledCodeOwners(removed + added)
+
+    for path, changed_rule in iter_resolved_code_owners(changed_rules, paths):
+        if changed_rule is None:
+            continue
+        old_owner = old_codeowners.resolve(path)
+        new_owner = new_codeowners.resolve(path)
+        if _owners_of(old_owner) != _owners_of(new_owner):
+            yield OwnershipChange(path, old_owner, new_owner)
+
+
+class LRUCache:
+    """A bounded mapping which evicts the least recently used entries, and counts hits and misses. Safe to use from several threads."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # i.e. an entry can be evicted, or the cache cleared, between finding an entry and moving it to the end
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+
+
+# If CODEOWNERS files exist in more than one of those locations, GitHub will search for them in that order and use the first one it finds.
+CODEOWNERS_LOCATIONS = ['.github/CODEOWNERS', 'CODEOWNERS', 'docs/CODEOWNERS']
+
+
 def get_code_owners_file(repo_root: Path) -> Optional[Path]:
-    try_locations = [ './.github/', './', './docs']
-    # If CODEOWNERS files exist in more than one of those locations, GitHub will search for them in that order and use the first one it finds.
-    
-    for folder in try_locations:
-        path = repo_root / folder / 'CODEOWNERS'
-        if path.is_file():
-            return path
+    before = time.perf_counter()
+    try:
+        for location in CODEOWNERS_LOCATIONS:
+            path = repo_root / location
+            if path.is_file():
+                return path
+
+        return None
+    finally:
+        stats.record_duration('find CODEOWNERS file', time.perf_counter() - before)
+
+
+def get_code_owners_real_path(folder_path: Path) -> Optional[str]:
+    """The real path of the CODEOWNERS file which applies to the folder, as the same file can be reached through symlinks, or from nested folders."""
+    # the CODEOWNERS file can appear, move or disappear i.e. when changing branches, so it is looked for every time
+    codeowners_file = get_code_owners_file(folder_path)
+    return os.path.realpath(codeowners_file) if codeowners_file else None
+
+
+class FolderPrefixes:
+    """A sorted list of folders, to find those containing a path with a few binary searches rather than by checking every folder."""
+
+    def __init__(self, folder_paths: Iterable[str]):
+        # with a trailing separator, so that i.e. `/foo` doesn't contain `/foobar/test`
+        self.folders = sorted({os.path.join(folder_path, '') for folder_path in folder_paths})
+
+    def get_folders_containing(self, file_name: str) -> Iterator[str]:
+        """The folders which contain the given absolute path, deepest first, without trailing separators."""
+        index = bisect_right(self.folders, file_name)
+        while index > 0:
+            folder = self.folders[index - 1]
+            if file_name.startswith(folder):
+                yield folder[:-1] if len(folder) > 1 else folder
+            # every folder sorted between a containing folder and the path itself starts with that containing folder,
+            # so the next one can only be a parent folder common to both, and everything after that can be skipped
+            common = os.path.commonprefix([folder, file_name])
+            index = bisect_right(self.folders, common[:common.rfind(os.sep) + 1], 0, index - 1)
+
+
+# rule sets by git blob id, so that going back and forth between revisions never parses the same CODEOWNERS content twice
+code_owners_by_blob_id = LRUCache(maxsize=32)
+
+
+def get_code_owners_at_revision(cat_file: 'GitCatFile', revision: str) -> Optional[CompiledCodeOwners]:
+    """The rules from the CODEOWNERS file as of the given git revision, found the same way GitHub would. `cat_file` is a `git.GitCatFile` for the repository."""
+    for location in CODEOWNERS_LOCATIONS:
+        blob_id = cat_file.get_object_id(f'{revision}:{location}')
+        if not blob_id:
+            continue
+
+        codeowners = code_owners_by_blob_id.get(blob_id)
+        if codeowners is None:
+            content = cat_file.read_object(blob_id)
+            if content is None:
+                continue
+            codeowners = CompiledCodeOwners(parse_code_owners(Path(location), content.decode('utf-8')))
+            code_owners_by_blob_id.put(blob_id, codeowners)
+        return codeowners
 
     return None
+
+
+_generations = itertools.count(1)
+
+
+class LoadedCodeOwners:
+    """A compiled rule set, along with enough information about the CODEOWNERS file it was parsed from to cheaply tell whether it is stale.
+
+    Each one gets a unique `generation`, so anything derived from the rules can be keyed by it.
+    `parsed_in_full` tells whether the whole file was parsed, rather than the rules coming from the on-disk cache or an incremental reparse.
+    """
+
+    def __init__(self, codeowners_file_path: Path, mtime_ns: Optional[int], size: int, content: str, content_hash: str, codeowners: CompiledCodeOwners, parsed_in_full: bool = False):
+        self.codeowners_file_path = codeowners_file_path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.content = content
+        self.content_hash = content_hash
+        self.codeowners = codeowners
+        self.parsed_in_full = parsed_in_full
+        self.generation = next(_generations)
+
+    def mark_stale(self) -> None:
+        """Make the next `load_code_owners` check the file content, even if its modification time and size look the same."""
+        self.mtime_ns = None
+
+
+def load_code_owners(codeowners_file_path: Path, previous: Optional[LoadedCodeOwners] = None, cache_dir: Optional[Path] = None) -> LoadedCodeOwners:
+    """Parse and compile the given CODEOWNERS file, unless it hasn't changed since `previous` was loaded from it, in which case `previous` is returned.
+
+    If it has changed, only the parts which changed are parsed again.
+    Otherwise, when a `cache_dir` is given, the rules are taken from the on-disk cache if they were saved there by `save_cached_code_owners`.
+    """
+    stat = os.stat(codeowners_file_path)
+    if previous is not None and previous.codeowners_file_path != codeowners_file_path:
+        previous = None
+    if previous is not None and (previous.mtime_ns, previous.size) == (stat.st_mtime_ns, stat.st_size):
+        stats.increment('rule set unchanged (stat)')
+        return previous
+
+    content_bytes = codeowners_file_path.read_bytes()
+    content_hash = hashlib.sha1(content_bytes).hexdigest()
+    if previous is not None and previous.content_hash == content_hash:
+        # i.e. touched, or switched to a branch with the same CODEOWNERS - no need to parse it again
+        previous.mtime_ns, previous.size = stat.st_mtime_ns, stat.st_size
+        stats.increment('rule set unchanged (content)')
+        return previous
+
+    content = content_bytes.decode('utf-8')
+    changed_lines = find_changed_lines(previous.content, content) if previous is not None else None
+    codeowners = None
+    if changed_lines:
+        stats.increment('rule set reparsed incrementally')
+        with stats.timed('incremental reparse'):
+            codeowners = reparse_code_owners(previous.codeowners, codeowners_file_path, content, *changed_lines)
+    elif cache_dir is not None:
+        with stats.timed('load from rules cache'):
+            codeowners = load_cached_code_owners(cache_dir, content_hash, codeowners_file_path)
+        stats.increment('rules cache hit' if codeowners is not None else 'rules cache miss')
+    parsed_in_full = codeowners is None
+    if parsed_in_full:
+        stats.increment('rule set parsed')
+        with stats.timed('full parse'):
+            codeowners = CompiledCodeOwners(parse_code_owners(codeowners_file_path, content))
+    return LoadedCodeOwners(codeowners_file_path, stat.st_mtime_ns, stat.st_size, content, content_hash, codeowners, parsed_in_full)
+
+
+def reload_code_owners(real_path: str, rule_sets: Dict[str, LoadedCodeOwners], cache_dir: Optional[Path] = None) -> Optional[LoadedCodeOwners]:
+    """Bring the rule set for the CODEOWNERS file at `real_path` in `rule_sets` (keyed by real path) up to date, or forget it if the file is gone."""
+    try:
+        loaded = load_code_owners(Path(real_path), rule_sets.get(real_path), cache_dir)
+    except FileNotFoundError:
+        rule_sets.pop(real_path, None)
+        return None
+    rule_sets[real_path] = loaded
+    return loaded
+
+
+# the cache is only valid for the same cache format, and the same versions of the libraries which produced its contents
+CACHE_FORMAT_VERSION = 1
+_CACHE_KEY = f'v{CACHE_FORMAT_VERSION}-py{sys.version_info[0]}{sys.version_info[1]}-wcmatch{wcmatch_version}'
+_CACHE_FILES_TO_KEEP = 20
+
+
+def get_cache_file_path(cache_dir: Path, content_hash: str) -> Path:
+    return cache_dir / f'{content_hash}.{_CACHE_KEY}.rules'
+
+
+def save_cached_code_owners(cache_dir: Path, content_hash: str, codeowners: CompiledCodeOwners) -> None:
+    """Write the parsed rules, and the regular expression source of each rule's matcher, to the on-disk cache so that `load_cached_code_owners` can skip parsing and translating them.
+
+    This translates every rule which hasn't been compiled yet, so it is best done in the background.
+    """
+    comments: Dict[Optional[str], int] = dict()
+    rules = list()
+    for specification in codeowners.specifications:
+        comment_index = comments.setdefault(specification.nearest_comment, len(comments))
+        rules.append((comment_index, specification.glob_pattern, specification.owners, specification.line_number))
+    regex_sources = [codeowners.matchers.get_regex_source(index) for index in range(len(codeowners.matchers))]
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    cache_file_path = get_cache_file_path(cache_dir, content_hash)
+    # several threads, as well as processes, can save the same rules at once
+    temp_file_path = cache_file_path.with_name(f'{cache_file_path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    temp_file_path.write_bytes(marshal.dumps((_CACHE_KEY, content_hash, list(comments.keys()), rules, regex_sources)))
+    os.replace(temp_file_path, cache_file_path)
+
+    # one file is written per version of each CODEOWNERS file seen, so only keep the most recently written ones
+    cache_files = sorted(cache_dir.glob('*.rules'), key=_get_modified_time, reverse=True)
+    for old_cache_file in cache_files[_CACHE_FILES_TO_KEEP:]:
+        try:
+            old_cache_file.unlink()
+        except OSError:
+            pass
+
+
+def _get_modified_time(path: Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except OSError: # i.e. just removed by another save's pruning
+        return 0.0
+
+
+def load_cached_code_owners(cache_dir: Path, content_hash: str, codeowners_file_path: Path) -> Optional[CompiledCodeOwners]:
+    """Load the rules for the CODEOWNERS content with the given hash from the on-disk cache, if they are there."""
+    cache_file_path = get_cache_file_path(cache_dir, content_hash)
+    try:
+        with open(cache_file_path, 'rb') as cache_file:
+            try:
+                with mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    cached = marshal.loads(mapped)
+            except ValueError: # i.e. an empty file can't be mapped
+                cached = marshal.loads(cache_file.read())
+        cache_key, cached_content_hash, comments, rules, regex_sources = cached
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if (cache_key, cached_content_hash) != (_CACHE_KEY, content_hash):
+        return None
+
+    specifications = [
+        CodeOwnerSpecification(comments[comment_index], glob_pattern, intern_owners(owners), line_number, codeowners_file_path)
+        for comment_index, glob_pattern, owners, line_number in rules
+    ]
+    return CompiledCodeOwners(specifications, RuleMatchers([specification.glob_pattern for specification in specifications], regex_sources))
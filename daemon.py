@@ -0,0 +1,303 @@
+"""A resident server which keeps the compiled rules of each repository's CODEOWNERS file warm, and answers ownership queries from the plugin, git hooks and other local tools over a Unix domain socket.
+
+Run from the package folder with `python -m daemon serve`, and query it with i.e. `python -m daemon query path/to/file ...`.
+
+Requests and responses are single lines of JSON, and a connection can be used for any number of them:
+
+    {"paths": ["/path/to/repo/file.py", ...]}            paths are absolute, and can be in different repositories
+    {"repo": "/path/to/repo", "paths": ["file.py", ...]}   paths are relative to the repository
+    {"command": "stats"}
+
+Resolving paths responds with `{"results": [...]}`, with a result for each path in the same order: either
+`{"owners": [...], "line": 12, "pattern": "/apps/", "comment": "# ...", "codeowners": "/path/to/repo/.github/CODEOWNERS"}`,
+or null when no rule applies. Invalid requests get `{"error": "..."}`.
+"""
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from .codeowners import CodeOwnerSpecification, LoadedCodeOwners, get_code_owners_real_path, iter_resolved_code_owners, reload_code_owners
+    from .git import find_repository_root, forget_repository_roots
+    from .instrumentation import stats
+except ImportError:
+    from codeowners import CodeOwnerSpecification, LoadedCodeOwners, get_code_owners_real_path, iter_resolved_code_owners, reload_code_owners
+    from git import find_repository_root, forget_repository_roots
+    from instrumentation import stats
+
+
+# Unix domain sockets aren't available on Windows, where everything just resolves owners itself
+UNIX_SOCKETS_SUPPORTED = hasattr(socket, 'AF_UNIX')
+# how often the CODEOWNERS files are checked for changes, so that they are parsed again before the next query rather than during it
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+def get_default_socket_path() -> str:
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(runtime_dir, f'codeowner-insights-{os.getuid()}.sock')
+
+
+def specification_to_result(specification: Optional[CodeOwnerSpecification]) -> Optional[Dict[str, Any]]:
+    if specification is None:
+        return None
+    return {
+        'owners': list(specification.owners),
+        'line': specification.line_number,
+        'pattern': specification.glob_pattern,
+        'comment': specification.nearest_comment,
+        'codeowners': str(specification.codeowners_file_path),
+    }
+
+
+def result_to_specification(result: Optional[Dict[str, Any]]) -> Optional[CodeOwnerSpecification]:
+    if result is None:
+        return None
+    return CodeOwnerSpecification(result['comment'], result['pattern'], tuple(result['owners']), result['line'], Path(result['codeowners']))
+
+
+class OwnershipService:
+    """The rule sets of the CODEOWNERS files of the repositories which have been asked about, keyed by real path, and kept up to date with the files."""
+
+    def __init__(self):
+        self.rule_sets: Dict[str, LoadedCodeOwners] = dict()
+        self._lock = threading.Lock()
+
+    def get_code_owners(self, repository_root: str) -> Optional[LoadedCodeOwners]:
+        real_path = get_code_owners_real_path(Path(repository_root))
+        if not real_path:
+            return None
+        with self._lock:
+            return reload_code_owners(real_path, self.rule_sets)
+
+    def refresh(self) -> None:
+        # so that repositories nested in the known ones, i.e. submodules added since, are noticed
+        forget_repository_roots()
+        for real_path in list(self.rule_sets):
+            with self._lock:
+                reload_code_owners(real_path, self.rule_sets)
+
+    def resolve(self, paths: List[str], repository_root: Optional[str] = None) -> List[Optional[Dict[str, Any]]]:
+        before = time.perf_counter()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(paths)
+        # (position in the request, repository relative path) for each repository
+        by_repository: Dict[str, List[Tuple[int, str]]] = dict()
+        for position, path in enumerate(paths):
+            if repository_root:
+                by_repository.setdefault(repository_root, list()).append((position, path))
+                continue
+            root = find_repository_root(os.path.dirname(path))
+            if root:
+                by_repository.setdefault(root, list()).append((position, os.path.relpath(path, root)))
+
+        for root, positioned_paths in by_repository.items():
+            loaded = self.get_code_owners(root)
+            if not loaded:
+                continue
+            resolved = iter_resolved_code_owners(loaded.codeowners, (path for _, path in positioned_paths))
+            for (position, _), (_, specification) in zip(positioned_paths, resolved):
+                results[position] = specification_to_result(specification)
+        stats.record_duration('daemon query', time.perf_counter() - before)
+        stats.record_size('daemon paths per query', len(paths))
+        return results
+
+    def handle_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        command = request.get('command', 'resolve')
+        if command == 'resolve':
+            return { 'results': self.resolve(request['paths'], request.get('repo')) }
+        if command == 'stats':
+            return { 'stats': stats.format_report(), 'codeowners_files': { real_path: len(loaded.codeowners) for real_path, loaded in self.rule_sets.items() } }
+        raise ValueError(f'unknown command {command!r}')
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                response = self.server.service.handle_request(json.loads(line))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                response = { 'error': str(e) }
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class OwnershipServer(socketserver.ThreadingUnixStreamServer if UNIX_SOCKETS_SUPPORTED else socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, service: Optional[OwnershipService] = None, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.service = service or OwnershipService()
+        self.poll_interval = poll_interval
+        self._stopped = threading.Event()
+        super().__init__(socket_path, _RequestHandler)
+        # only the user running it can ask about their files
+        os.chmod(socket_path, 0o600)
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        threading.Thread(target=self._watch, name='CodeOwnerInsights watcher', daemon=True).start()
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self._stopped.set()
+
+    def _watch(self) -> None:
+        # polling is a stat of each CODEOWNERS file, which is cheap enough not to need platform specific file watching
+        while not self._stopped.wait(self.poll_interval):
+            self.service.refresh()
+
+    def server_close(self) -> None:
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def is_server_running(socket_path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+        try:
+            client_socket.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+class OwnershipClient:
+    """A connection to the server, which is opened when first needed and opened again if the server restarted. Safe to use from several threads."""
+
+    def __init__(self, socket_path: Optional[str] = None, timeout: float = 1.0):
+        self.socket_path = socket_path or get_default_socket_path()
+        self.timeout = timeout
+        self._socket: Optional[socket.socket] = None
+        self._reader: Optional[BinaryIO] = None
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> 'OwnershipClient':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def is_available(self) -> bool:
+        return UNIX_SOCKETS_SUPPORTED and os.path.exists(self.socket_path)
+
+    def request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        data = json.dumps(request).encode('utf-8') + b'\n'
+        with self._lock:
+            try:
+                line = self._send(data)
+            except socket.timeout:
+                # the response could still arrive, and be taken for the response to the next request
+                self._disconnect()
+                raise
+            except OSError:
+                # the connection may be from before the server restarted, so try once more with a new one
+                self._disconnect()
+                line = self._send(data)
+        response = json.loads(line)
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response
+
+    def _send(self, data: bytes) -> bytes:
+        if self._socket is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            try:
+                # refused when the socket file was left behind by a server which was killed
+                connection.connect(self.socket_path)
+            except OSError:
+                connection.close()
+                raise
+            self._socket = connection
+            self._reader = connection.makefile('rb')
+        self._socket.sendall(data)
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError('the server closed the connection')
+        return line
+
+    def resolve(self, paths: List[str], repository_root: Optional[str] = None) -> List[Optional[CodeOwnerSpecification]]:
+        request: Dict[str, Any] = { 'paths': paths }
+        if repository_root:
+            request['repo'] = repository_root
+        return [result_to_specification(result) for result in self.request(request)['results']]
+
+    def _disconnect(self) -> None:
+        if self._reader is not None:
+            self._reader.close()
+        if self._socket is not None:
+            self._socket.close()
+        self._socket = self._reader = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._disconnect()
+
+
+def serve(args: Namespace) -> None:
+    if os.path.exists(args.socket):
+        if is_server_running(args.socket):
+            raise SystemExit(f'Already running, on {args.socket}')
+        # left behind by a server which didn't shut down cleanly
+        os.unlink(args.socket)
+    # stopping it i.e. from a service manager should remove the socket too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with OwnershipServer(args.socket, poll_interval=args.poll_interval) as server:
+        print(f'Listening on {args.socket}', file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def query(args: Namespace) -> None:
+    paths = [os.path.abspath(path) for path in args.paths]
+    with OwnershipClient(args.socket) as client:
+        for path, specification in zip(args.paths, client.resolve(paths)):
+            if specification:
+                print(f'{path}\t{" ".join(specification.owners)}\t{specification.line_number}')
+            else:
+                print(f'{path}\t\t')
+
+
+def show_stats(args: Namespace) -> None:
+    with OwnershipClient(args.socket) as client:
+        response = client.request({ 'command': 'stats' })
+    for real_path, rule_count in response['codeowners_files'].items():
+        print(f'{real_path}: {rule_count} rules')
+    print(response['stats'], end='')
+
+
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser(prog='python -m daemon', description='Keep CODEOWNERS rules compiled in a resident process, and answer ownership queries over a Unix domain socket.')
+    parser.add_argument('--socket', default=get_default_socket_path(), help='path of the Unix domain socket (default: %(default)s)')
+    sub_parsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = sub_parsers.add_parser('serve', help='Run the server until interrupted.')
+    serve_parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL, help='seconds between checks for changed CODEOWNERS files (default: %(default)s)')
+    serve_parser.set_defaults(func=serve)
+
+    query_parser = sub_parsers.add_parser('query', help='Ask the server for the owners of the given files, written as `path<TAB>owners<TAB>line`.')
+    query_parser.add_argument('paths', nargs='+', help='files, which can be in any repository')
+    query_parser.set_defaults(func=query)
+
+    stats_parser = sub_parsers.add_parser('stats', help="Show the server's counters and timings.")
+    stats_parser.set_defaults(func=show_stats)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = create_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,65 +1,292 @@
+from collections import deque
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import AsyncIterator, Deque, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+import asyncio
 import os
-import sys
-from subprocess import run, PIPE
+import shlex
+from subprocess import run, CalledProcessError, CompletedProcess, Popen, PIPE, DEVNULL
+import tempfile
+import threading
 import time
 
+try:
+    from .instrumentation import stats
+except ImportError:
+    from instrumentation import stats
+
+
+# the most recent git commands run, with how long each took in seconds
+git_command_timings: Deque[Tuple[Tuple[str, ...], float]] = deque(maxlen=100)
+
+
+def record_git_command_timing(args: Tuple[str, ...], duration: float) -> None:
+    git_command_timings.append((args, duration))
+    stats.record_duration(f'git {args[0]}', duration)
+
 
 def get_git_changed_files_compared_to_branch(folder_path: Path, base_branch_name: str, filter: Optional[str] = None) -> Iterable[Path]:
     """filter can be like --relative=source/ or '*.php' etc."""
-    current_branch = get_current_branch(folder_path)[0].stdout.rstrip()
     # find the common ancestor incase local or remote base branch is more up to date than the feature branch
-    merge_base = exec_command(folder_path, f'git merge-base {base_branch_name} {current_branch}')[0].stdout.rstrip()
-    files = exec_command(folder_path, f'git diff {merge_base} --name-only --diff-filter=ACMR {filter or ""}')[0].stdout
-    return (Path(file) for file in files.split('\n') if file) # purists would say that files can be named with \n chars...
+    # (HEAD is the current branch, so there is no need to look up its name first)
+    merge_base = run_git(folder_path, 'merge-base', base_branch_name, 'HEAD').stdout.rstrip()
+    if not merge_base:
+        return ()
+    files = run_git(folder_path, 'diff', merge_base, '--name-only', '-z', '--diff-filter=ACMR', *shlex.split(filter or '')).stdout
+    return (Path(file) for file in files.split('\0') if file)
 
 
 def get_git_changed_files_compared_to_default_branch(folder_path: Path, filter: Optional[str] = None) -> Iterable[Path]:
     """filter can be like --relative=source/ or '*.php' etc."""
     # https://stackoverflow.com/q/28666357/4473405
-    default_branch = get_default_branch(folder_path)[0].stdout.rstrip()
+    default_branch = get_default_branch(folder_path)
+    if not default_branch:
+        return ()
     return get_git_changed_files_compared_to_branch(folder_path, default_branch, filter)
 
 
+def get_git_tracked_files(folder_path: Path) -> Iterable[str]:
+    """All files tracked by git, relative to the repository root. These are strings rather than `Path`s as there can be a great many of them.
+
+    Raises `CalledProcessError`, with git's error output as its `stderr`, when git fails, i.e. outside of a repository - rather than claiming that no files are tracked.
+    """
+    p = run_git(folder_path, 'ls-files', '-z')
+    p.check_returncode()
+    return (file for file in p.stdout.split('\0') if file)
+
+
+# folder -> the closest folder at or above it which contains `.git`. Only folders found to be in a repository are remembered, as one can be created, cloned or added as a submodule at any time
+_repository_roots: Dict[str, str] = dict()
+REPOSITORY_ROOTS_CACHE_SIZE = 4096
+
+
+def find_repository_root(folder_path: str) -> Optional[str]:
+    """The closest folder at or above the given one which contains `.git` (a folder, or a file for worktrees and submodules), like `git rev-parse --show-toplevel` but without starting a process.
+
+    Results are memoized per folder, and sibling folders share the lookups of their common parents. A remembered root is checked to still be a repository each time, and `forget_repository_roots` forgets them all, i.e. to find submodules added since.
+    """
+    root = _repository_roots.get(folder_path)
+    if root is not None and os.path.exists(os.path.join(root, '.git')):
+        return root
+    if os.path.exists(os.path.join(folder_path, '.git')):
+        root = folder_path
+    else:
+        parent = os.path.dirname(folder_path)
+        root = find_repository_root(parent) if parent != folder_path else None
+        if root is None:
+            _repository_roots.pop(folder_path, None)
+            return None
+    if len(_repository_roots) >= REPOSITORY_ROOTS_CACHE_SIZE:
+        _repository_roots.clear()
+    _repository_roots[folder_path] = root
+    return root
+
+
+def forget_repository_roots() -> None:
+    _repository_roots.clear()
+
+
 def get_default_branch(folder_path: Path) -> Optional[str]:
-    shell_cmd = "git rev-parse --abbrev-ref origin/HEAD | cut -d / -f 2"
-    # proc = ExecProcess()
-    # async with timeout(10):
-    #     output, killed, exit_code = await proc.exec(, loop)
-    #     if exit_code == 0 and not killed:
-    #         return output
-    #     return None
-    return exec_command(folder_path, shell_cmd)
+    # see `stream_git_changed_files_compared_to_default_branch` for an asynchronous, cancellable equivalent
+    p = run_git(folder_path, 'rev-parse', '--abbrev-ref', 'origin/HEAD')
+    if p.returncode != 0:
+        # most likely there is no origin/HEAD
+        return None
+    # origin/HEAD resolves to i.e. origin/main, and the local branch is wanted
+    return p.stdout.rstrip().split('/', 1)[-1]
 
 
 def get_current_branch(folder_path: Path) -> Optional[str]:
-    shell_cmd = "git rev-parse --abbrev-ref HEAD"
-    return exec_command(folder_path, shell_cmd)
-
-
-def exec_command(folder_path: Path, shell_cmd: str):
-    # this shell_cmd/cmd logic was borrowed from Packages/Default/exec.py
-
-    os.chdir(str(folder_path))
-    if shell_cmd:
-        if sys.platform == "win32":
-            # Use shell=True on Windows, so shell_cmd is passed through
-            # with the correct escaping
-            cmd = shell_cmd
-            shell = True
-        else:
-            cmd = ["/usr/bin/env", "bash", "-c", shell_cmd]
-            shell = False
-    else:
-        shell = False
-    return execute_with_stdin(cmd, shell, '')
+    p = run_git(folder_path, 'rev-parse', '--abbrev-ref', 'HEAD')
+    return p.stdout.rstrip() if p.returncode == 0 else None
+
+
+async def stream_git_changed_files_compared_to_default_branch(folder_path: Path, filter: Optional[str] = None) -> AsyncIterator[List[Path]]:
+    """Like `get_git_changed_files_compared_to_default_branch`, but yields batches of paths as git outputs them, so that they can be processed before git has finished.
+
+    Cancelling the task consuming this kills the git process.
+    """
+    p = await run_git_async(folder_path, 'rev-parse', '--abbrev-ref', 'origin/HEAD')
+    if p.returncode != 0:
+        return
+    default_branch = p.stdout.rstrip().split('/', 1)[-1]
+    merge_base = (await run_git_async(folder_path, 'merge-base', default_branch, 'HEAD')).stdout.rstrip()
+    if not merge_base:
+        return
+
+    args = ('diff', merge_base, '--name-only', '-z', '--diff-filter=ACMR', *shlex.split(filter or ''))
+    before = time.perf_counter()
+    process = await asyncio.create_subprocess_exec('git', *args, cwd=folder_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+    try:
+        pending = b''
+        while True:
+            data = await process.stdout.read(65536)
+            if not data:
+                break
+            *files, pending = (pending + data).split(b'\0')
+            batch = [Path(os.fsdecode(file)) for file in files if file]
+            if batch:
+                yield batch
+        if pending:
+            yield [Path(os.fsdecode(pending))]
+        await process.wait()
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        record_git_command_timing(args, time.perf_counter() - before)
+
 
+def stream_git_log_changed_files(folder_path: Path, *log_args: str) -> Iterator[Tuple[str, List[str]]]:
+    """Yield the id and changed files of each commit `git log` lists (newest first by default), as git outputs them, so that even a very long history is never held in memory.
 
-def execute_with_stdin(cmd, shell, text):
+    `log_args` are passed on to `git log`, i.e. `'--max-count=1000', '--no-merges'`. Merge commits have no changed files, as `git log` doesn't diff them by default.
+    Closing the generator early kills the git process. Raises `CalledProcessError`, with git's error output as its `stderr`, when git fails, i.e. for an unknown revision.
+    """
+    # paths git tracks never start with a slash, which tells the commit headers apart from the files
+    args = ('log', '-z', '--name-only', '--format=/%H', *log_args)
+    before = time.perf_counter()
+    # a file rather than a pipe, which would fill up and block git while only stdout is being read
+    errors = tempfile.TemporaryFile()
+    process = Popen(['git', *args], cwd=folder_path, stdout=PIPE, stderr=errors)
+    try:
+        commit: Optional[str] = None
+        files: List[str] = list()
+        pending = b''
+        while True:
+            data = process.stdout.read1(65536)
+            if not data:
+                break
+            *tokens, pending = (pending + data).split(b'\0')
+            for token in tokens:
+                if token.startswith(b'/'):
+                    if commit is not None:
+                        yield commit, files
+                    commit = token[1:].decode('ascii')
+                    files = list()
+                elif token:
+                    # the first file of each commit follows the newline which ends its header
+                    if not files and token.startswith(b'\n'):
+                        token = token[1:]
+                    files.append(os.fsdecode(token))
+        if commit is not None:
+            yield commit, files
+        if process.wait() != 0:
+            errors.seek(0)
+            raise CalledProcessError(process.returncode, process.args, stderr=errors.read().decode('utf-8', 'replace'))
+    finally:
+        if process.returncode is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        errors.close()
+        record_git_command_timing(args, time.perf_counter() - before)
+
+
+async def run_git_async(folder_path: Path, *args: str) -> CompletedProcess:
+    """Like `run_git`, but without blocking the event loop."""
+    before = time.perf_counter()
+    process = await asyncio.create_subprocess_exec('git', *args, cwd=folder_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await process.communicate()
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    record_git_command_timing(args, time.perf_counter() - before)
+    return CompletedProcess(['git', *args], process.returncode, stdout.decode('utf-8'), stderr.decode('utf-8'))
+
+
+def run_git(folder_path: Path, *args: str) -> CompletedProcess:
+    """Run git directly (not through a shell) in the given folder, and record how long it took."""
+    p, duration = execute_with_stdin(['git', *args], False, '', cwd=folder_path)
+    record_git_command_timing(args, duration)
+    return p
+
+
+def get_git_command_timings() -> List[Tuple[Tuple[str, ...], float]]:
+    return list(git_command_timings)
+
+
+def execute_with_stdin(cmd, shell, text, cwd: Optional[Path] = None):
     before = time.perf_counter()
     # https://docs.python.org/3/library/subprocess.html#subprocess.run - new in version 3.5
     # therefore, you need to be using ST build >= 4050 and the package should be opting in to Python 3.8 plugin host
-    p = run(cmd, shell=shell, capture_output=True, input=text, encoding='utf-8')
+    p = run(cmd, shell=shell, capture_output=True, input=text, encoding='utf-8', cwd=cwd)
     after = time.perf_counter()
     return (p, after - before)
+
+
+class GitCatFile:
+    """Long running `git cat-file --batch-check` and `git cat-file --batch` processes for a repository, to look up and read objects at any revision without starting a new process each time.
+
+    Object names are anything git understands, i.e. `HEAD:.github/CODEOWNERS` or a blob id.
+    """
+
+    def __init__(self, folder_path: Path):
+        self.folder_path = folder_path
+        self._check_process: Optional[Popen] = None
+        self._batch_process: Optional[Popen] = None
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> 'GitCatFile':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _get_process(self, process: Optional[Popen], mode: str) -> Popen:
+        if process is None or process.poll() is not None:
+            process = Popen(['git', 'cat-file', mode], cwd=self.folder_path, stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
+        return process
+
+    def _request(self, process: Popen, object_name: str) -> Optional[Tuple[str, str, int]]:
+        process.stdin.write(object_name.encode('utf-8') + b'\n')
+        process.stdin.flush()
+        header = process.stdout.readline().decode('utf-8').split()
+        if len(header) != 3: # i.e. `<name> missing` or `<name> ambiguous`
+            return None
+        object_id, object_type, size = header
+        return (object_id, object_type, int(size))
+
+    def get_object_id(self, object_name: str, object_type: str = 'blob') -> Optional[str]:
+        """The id of the named object, if it exists and is of the given type."""
+        before = time.perf_counter()
+        with self._lock:
+            self._check_process = self._get_process(self._check_process, '--batch-check')
+            header = self._request(self._check_process, object_name)
+        record_git_command_timing(('cat-file', '--batch-check', object_name), time.perf_counter() - before)
+        if header is None or header[1] != object_type:
+            return None
+        return header[0]
+
+    def read_object(self, object_name: str) -> Optional[bytes]:
+        """The content of the named object, if it exists."""
+        before = time.perf_counter()
+        with self._lock:
+            self._batch_process = self._get_process(self._batch_process, '--batch')
+            header = self._request(self._batch_process, object_name)
+            content = None
+            if header is not None:
+                content = _read_exactly(self._batch_process.stdout, header[2])
+                self._batch_process.stdout.read(1) # the newline after the content
+        record_git_command_timing(('cat-file', '--batch', object_name), time.perf_counter() - before)
+        return content
+
+    def close(self) -> None:
+        with self._lock:
+            for process in (self._check_process, self._batch_process):
+                if process is not None and process.poll() is None:
+                    process.stdin.close()
+                    process.wait()
+            self._check_process = self._batch_process = None
+
+
+def _read_exactly(stream: IO[bytes], size: int) -> bytes:
+    chunks = list()
+    while size > 0:
+        chunk = stream.read(size)
+        if not chunk:
+            raise EOFError('git cat-file exited unexpectedly')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
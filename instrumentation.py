@@ -0,0 +1,121 @@
+"""Lightweight counters and latency histograms for the hot paths, to tell where the time goes when i.e. the status bar lags, and a way to profile a single call."""
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+import cProfile
+import io
+import pstats
+import time
+
+
+class Histogram:
+    """Counts of the recorded values in power of two buckets, so that recording is cheap and the memory used stays the same however many values are recorded."""
+
+    __slots__ = ('buckets', 'count', 'total', 'maximum')
+
+    BUCKET_COUNT = 48
+
+    def __init__(self):
+        self.buckets = [0] * self.BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+
+    def record(self, value: float) -> None:
+        # bucket n holds the values from 2**(n-1) up to (but not including) 2**n, and bucket 0 holds 0
+        self.buckets[min(int(value).bit_length(), self.BUCKET_COUNT - 1)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+
+    def percentile(self, fraction: float) -> float:
+        """An upper bound for the given percentile (i.e. 0.9), accurate to within a factor of two."""
+        wanted = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                return min(2 ** bucket, self.maximum)
+        return self.maximum
+
+    def describe(self, unit: str = '', scale: float = 1) -> str:
+        if not self.count:
+            return 'count=0'
+        return ' '.join([
+            f'count={self.count}',
+            f'mean={self.total / self.count / scale:.3g}{unit}',
+            f'p50<={self.percentile(0.5) / scale:.3g}{unit}',
+            f'p90<={self.percentile(0.9) / scale:.3g}{unit}',
+            f'p99<={self.percentile(0.99) / scale:.3g}{unit}',
+            f'max={self.maximum / scale:.3g}{unit}',
+        ])
+
+
+class Stats:
+    """Named counters, duration histograms (recorded in microseconds) and size histograms (i.e. how many rules were evaluated).
+
+    Nothing is locked: the odd lost update from another thread is an acceptable price for keeping recording cheap.
+    """
+
+    def __init__(self):
+        self.counters: Counter = Counter()
+        self.durations: Dict[str, Histogram] = dict()
+        self.sizes: Dict[str, Histogram] = dict()
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        self.counters[name] += amount
+
+    def record_duration(self, name: str, seconds: float) -> None:
+        histogram = self.durations.get(name)
+        if histogram is None:
+            histogram = self.durations[name] = Histogram()
+        histogram.record(seconds * 1000000)
+
+    def record_size(self, name: str, value: int) -> None:
+        histogram = self.sizes.get(name)
+        if histogram is None:
+            histogram = self.sizes[name] = Histogram()
+        histogram.record(value)
+
+    @contextmanager
+    def timed(self, name: str) -> Iterator[None]:
+        before = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_duration(name, time.perf_counter() - before)
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.durations.clear()
+        self.sizes.clear()
+
+    def format_report(self) -> str:
+        lines: List[str] = list()
+        if self.counters:
+            lines.append('Counters:')
+            lines.extend(f'  {name}: {count}' for name, count in sorted(self.counters.items()))
+        if self.durations:
+            lines.append('Durations:')
+            lines.extend(f'  {name}: {histogram.describe("ms", 1000)}' for name, histogram in sorted(self.durations.items()))
+        if self.sizes:
+            lines.append('Sizes:')
+            lines.extend(f'  {name}: {histogram.describe()}' for name, histogram in sorted(self.sizes.items()))
+        return '\n'.join(lines) + '\n' if lines else 'Nothing recorded yet\n'
+
+
+# the statistics for the whole plugin
+stats = Stats()
+
+
+def profile_call(function: Callable[..., Any], *args: Any, limit: int = 40, **kwargs: Any) -> Tuple[Any, str]:
+    """Call the function under cProfile, returning its result and the `limit` most expensive functions by cumulative time.
+
+    Only the calling thread is profiled.
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function, *args, **kwargs)
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(limit)
+    return result, output.getvalue()
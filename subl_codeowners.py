@@ -1,21 +1,57 @@
 import sublime
 import sublime_plugin
 
-from typing import Iterable, Optional, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 from pathlib import Path
 #from wcmatch.pathlib import Path
+import asyncio
+import html
+import itertools
 import os
+from subprocess import CalledProcessError
+import threading
+import time
 
-from .codeowners import CodeOwnerSpecification, get_code_owners_file, parse_code_owners, get_resolved_code_owners_for_file
-from .git import get_git_changed_files_compared_to_default_branch
+from .codeowners import CodeOwnerSpecification, FolderPrefixes, LoadedCodeOwners, LRUCache, OwnershipMap, code_owners_by_blob_id, get_cache_file_path, get_code_owners_real_path, reload_code_owners, save_cached_code_owners, get_resolved_code_owners_for_file, iter_resolved_code_owners
+from .git import find_repository_root, forget_repository_roots, get_git_command_timings, get_git_tracked_files, stream_git_changed_files_compared_to_default_branch
+from .daemon import UNIX_SOCKETS_SUPPORTED, OwnershipClient
+from .instrumentation import profile_call, stats
 
 
 STATUS_BAR_KEY = 'codeowner'
-codeowner_window_cache = {}
+# rule sets by the real path of their CODEOWNERS file, shared by every window and folder in the same repository
+shared_code_owners: Dict[str, LoadedCodeOwners] = dict()
+# window id -> {folder: real path of the CODEOWNERS file used for it}
+codeowner_window_cache: Dict[int, Dict[str, str]] = dict()
+# held while changing or going through the rule sets and window caches, which the UI and async threads both do
+code_owners_lock = threading.Lock()
+# window id -> the window's folders, for finding those containing a file
+project_folders_by_window: Dict[int, Tuple[List[str], FolderPrefixes]] = dict()
+# resolved code owner by (folder, file, rule set generation)
+codeowner_resolution_cache = LRUCache(maxsize=1024)
+_NOT_CACHED = object()
+# which rule owns each tracked file, by (folder, rule set generation, git index modification time)
+ownership_maps = LRUCache(maxsize=4)
+# how long to wait for more events on a view before updating its status bar, so that i.e. quickly cycling through tabs only updates the one which ends up active
+STATUS_BAR_UPDATE_DELAY_MS = 50
+# view id -> the most recently scheduled status bar update, any earlier ones are superseded by it
+pending_status_bar_updates: Dict[int, int] = dict()
+_status_bar_update_ids = itertools.count()
+# view id -> (file name, real path of the CODEOWNERS file, rule set generation) which the status bar currently shows the code owner for
+status_bar_states: Dict[int, Tuple[str, str, int]] = dict()
+
+
+# how long to wait for the daemon before resolving in process instead, in seconds - it answers in well under a millisecond unless something is wrong
+DAEMON_QUERY_TIMEOUT = 0.05
+# a connection to the ownership daemon (`python -m daemon serve`), used instead of parsing and matching in the plugin host when it is running
+ownership_client = OwnershipClient(timeout=DAEMON_QUERY_TIMEOUT) if UNIX_SOCKETS_SUPPORTED else None
+_UNANSWERED = object()
 
 
 def plugin_unloaded() -> None:
     clear_status_bar_for_all_open_windows()
+    if ownership_client:
+        ownership_client.close()
 
 
 def clear_status_bar_for_all_open_windows():
@@ -26,27 +62,83 @@ def clear_status_bar_for_all_open_windows():
 
 class CodeOwnerListener(sublime_plugin.EventListener):
     def on_load_async(self, view: sublime.View): # TODO: EventListener.on_load_async doesn't seem to be called when previewing via Goto Anything if file not already open
-        update_code_owner_in_status_bar(view)
+        schedule_status_bar_update(view)
 
     def on_save_async(self, view: sublime.View):
-        update_code_owner_in_status_bar(view)
+        file_name = view.file_name()
+        if file_name and os.path.basename(file_name) == 'CODEOWNERS':
+            invalidate_code_owners_file(file_name)
+        schedule_status_bar_update(view)
 
     def on_post_move_async(self, view: sublime.View):
-        update_code_owner_in_status_bar(view)
+        schedule_status_bar_update(view)
 
     def on_activated_async(self, view: sublime.View):
-        update_code_owner_in_status_bar(view)
+        schedule_status_bar_update(view)
+
+    def on_close(self, view: sublime.View):
+        pending_status_bar_updates.pop(view.id(), None)
+        status_bar_states.pop(view.id(), None)
 
     def on_pre_close_window(self, window: sublime.Window):
-        if window.id() in codeowner_window_cache:
-            del codeowner_window_cache[window.id()]
+        with code_owners_lock:
+            codeowner_window_cache.pop(window.id(), None)
+        project_folders_by_window.pop(window.id(), None)
+        forget_unused_code_owners()
 
     def on_load_project_async(self, window: sublime.Window):
-        pass # TODO: cache codeowners files
+        # i.e. a submodule added since the folders were last looked at
+        forget_repository_roots()
+        # load the rule sets up front, so that the first file opened doesn't have to wait for them
+        for folder_path in get_code_owner_roots_for_window(window):
+            get_code_owners_for_folder(window, folder_path)
+
+
+def schedule_status_bar_update(view: sublime.View) -> None:
+    """Update the status bar of the view shortly, unless another update for it is scheduled in the meantime. Called from the async thread, like the update itself."""
+    update_id = next(_status_bar_update_ids)
+    if view.id() in pending_status_bar_updates:
+        stats.increment('status bar update superseded')
+    pending_status_bar_updates[view.id()] = update_id
+    sublime.set_timeout_async(lambda: run_scheduled_status_bar_update(view, update_id), STATUS_BAR_UPDATE_DELAY_MS)
+
+
+def run_scheduled_status_bar_update(view: sublime.View, update_id: int) -> None:
+    if pending_status_bar_updates.get(view.id()) != update_id:
+        return
+    del pending_status_bar_updates[view.id()]
+
+    window = view.window()
+    if not view.is_valid() or not window or window.active_view() != view:
+        # only the active view's status bar is visible, and activating another view will update it then
+        stats.increment('status bar update skipped (inactive view)')
+        status_bar_states.pop(view.id(), None)
+        return
+    update_code_owner_in_status_bar(view)
+
+
+def is_status_bar_up_to_date(view: sublime.View) -> bool:
+    state = status_bar_states.get(view.id())
+    if not state or state[0] != view.file_name():
+        return False
+    # checking that the rule set is current is only a stat of the CODEOWNERS file
+    loaded = get_shared_code_owners(state[1])
+    return loaded is not None and loaded.generation == state[2]
 
 
 def update_code_owner_in_status_bar(view: sublime.View) -> None:
-    codeowner = get_code_owner_for_view(view)
+    if is_status_bar_up_to_date(view):
+        stats.increment('status bar update skipped (unchanged)')
+        return
+
+    with stats.timed('status bar update'):
+        codeowner = get_code_owner_for_view(view)
+    loaded = shared_code_owners.get(str(codeowner.codeowners_file_path)) if codeowner else None
+    if loaded:
+        status_bar_states[view.id()] = (view.file_name(), str(codeowner.codeowners_file_path), loaded.generation)
+    else:
+        status_bar_states.pop(view.id(), None)
+
     if not codeowner or not codeowner.owners:
         view.erase_status(STATUS_BAR_KEY)
     else:
@@ -55,7 +147,7 @@ def update_code_owner_in_status_bar(view: sublime.View) -> None:
         view.set_status(STATUS_BAR_KEY, f'Code Owner: {nearest_comment} - {", ".join(codeowner.owners)}')
 
 
-def get_code_owner_for_view(view: sublime.View) -> Optional[CodeOwnerSpecification]:
+def get_code_owner_for_view(view: sublime.View, use_daemon: bool = True) -> Optional[CodeOwnerSpecification]:
     file_name = view.file_name()
     if not file_name:
         return None
@@ -64,7 +156,12 @@ def get_code_owner_for_view(view: sublime.View) -> Optional[CodeOwnerSpecificati
     if not window:
         return None
 
-    for folder_path in get_project_folders_for_file(file_name, window):
+    if use_daemon:
+        codeowner = get_code_owner_from_daemon(file_name)
+        if codeowner is not _UNANSWERED:
+            return codeowner
+
+    for folder_path in get_code_owner_roots_for_file(file_name, window):
         codeowner = get_code_owner(window, folder_path, file_name)
         if codeowner:
             return codeowner
@@ -72,55 +169,208 @@ def get_code_owner_for_view(view: sublime.View) -> Optional[CodeOwnerSpecificati
     return None
 
 
-def get_project_folders_for_file(file_name: Path, window: sublime.Window) -> Iterable[Path]:
-    # TODO: this should be relative to git root, which may not be ST project root...
-    # `git rev-parse --show-toplevel` returns full path to folder containing .git folder (could be submodule)
-    for folder_path in window.folders():
-        if not file_name.startswith(folder_path + '/'):
-            # file is not under the given folder, so codeowners from the folder don't apply
-            # we added a slash in the check above to avoid false positives like a file called `foobar/test` from being matched against a top level folder called `foo`
-            continue
-
-        yield Path(folder_path)
+def get_code_owner_from_daemon(file_name: str):
+    """The code owner of the file according to the daemon, or `_UNANSWERED` when it isn't running or can't tell."""
+    if not ownership_client or not ownership_client.is_available():
+        return _UNANSWERED
+    try:
+        codeowner = ownership_client.resolve([file_name])[0]
+    except (OSError, ValueError):
+        stats.increment('daemon query failed')
+        return _UNANSWERED
+    if codeowner is None and not find_repository_root(os.path.dirname(file_name)):
+        # the daemon only knows about git repositories, but a project folder can have a CODEOWNERS file without being one
+        return _UNANSWERED
+    stats.increment('daemon query answered')
+    return codeowner
+
+
+def get_code_owner_roots_for_file(file_name: str, window: sublime.Window) -> Iterable[str]:
+    """The folders whose CODEOWNERS file could apply to the given file: the git repository it is in (which may be a submodule, or above the project folder), then the project folders containing it, deepest first."""
+    seen = set()
+    repository_root = find_repository_root(os.path.dirname(file_name))
+    if repository_root:
+        seen.add(repository_root)
+        yield repository_root
+
+    for folder_path in get_project_folders(window).get_folders_containing(file_name):
+        if folder_path not in seen:
+            seen.add(folder_path)
+            yield folder_path
+
+
+def get_code_owner_roots_for_window(window: sublime.Window) -> Iterable[str]:
+    """The git repositories of the window's folders, or the folders themselves when they aren't in one. Folders in the same repository share the same CODEOWNERS file, so each repository is only listed once."""
+    return dict.fromkeys(find_repository_root(folder_path) or folder_path for folder_path in window.folders())
+
+
+def get_project_folders(window: sublime.Window) -> FolderPrefixes:
+    folders = window.folders()
+    cached = project_folders_by_window.get(window.id())
+    if cached is None or cached[0] != folders:
+        cached = (folders, FolderPrefixes(folders))
+        project_folders_by_window[window.id()] = cached
+    return cached[1]
+
+
+def get_code_owners_for_folder(window: sublime.Window, folder_path: str) -> Optional[LoadedCodeOwners]:
+    real_path = get_code_owners_real_path(Path(folder_path))
+    loaded = get_shared_code_owners(real_path) if real_path else None
+    with code_owners_lock:
+        window_cache = codeowner_window_cache.setdefault(window.id(), dict())
+        if loaded:
+            window_cache[str(folder_path)] = real_path
+        else:
+            window_cache.pop(str(folder_path), None)
+    return loaded
+
+
+def get_shared_code_owners(real_path: str) -> Optional[LoadedCodeOwners]:
+    cache_dir = get_rules_cache_dir()
+    with code_owners_lock:
+        previous = shared_code_owners.get(real_path, None)
+        loaded = reload_code_owners(real_path, shared_code_owners, cache_dir)
+    if loaded is not None and loaded is not previous:
+        if previous is not None:
+            codeowner_resolution_cache.clear()
+        # an incremental reparse is quicker than loading from the cache, so only a full parse is worth saving
+        if loaded.parsed_in_full:
+            # this translates every rule which hasn't been compiled yet, which takes seconds for the largest files, so it gets a thread of its own
+            threading.Thread(target=save_rules_to_cache, args=(cache_dir, loaded), name='CodeOwnerInsights rules cache', daemon=True).start()
+    return loaded
+
+
+def forget_unused_code_owners() -> None:
+    with code_owners_lock:
+        in_use = {real_path for window_cache in codeowner_window_cache.values() for real_path in window_cache.values()}
+        for real_path in [real_path for real_path in shared_code_owners if real_path not in in_use]:
+            del shared_code_owners[real_path]
+
+
+def get_rules_cache_dir() -> Path:
+    return Path(sublime.cache_path()) / 'CodeOwnerInsights'
+
+
+def save_rules_to_cache(cache_dir: Path, loaded: LoadedCodeOwners) -> None:
+    if not get_cache_file_path(cache_dir, loaded.content_hash).is_file():
+        save_cached_code_owners(cache_dir, loaded.content_hash, loaded.codeowners)
+
+
+def invalidate_code_owners_file(file_name: str) -> None:
+    loaded = shared_code_owners.get(os.path.realpath(file_name))
+    if loaded:
+        # keep the entry, so that only the edited part of the file needs to be parsed again
+        loaded.mark_stale()
+
+
+def get_ownership_map(folder_path: str, loaded: LoadedCodeOwners) -> OwnershipMap:
+    """Which rule owns each file tracked by git in the folder, built once for as long as neither the rules nor the git index change."""
+    try:
+        # adding, removing or renaming files always writes the index
+        index_mtime = os.stat(os.path.join(folder_path, '.git', 'index')).st_mtime_ns
+    except OSError: # i.e. a worktree or submodule, where `.git` is a file
+        index_mtime = None
+    cache_key = (folder_path, loaded.generation, index_mtime)
+    ownership = ownership_maps.get(cache_key)
+    if ownership is None:
+        with stats.timed('build ownership map'):
+            ownership = OwnershipMap(loaded.codeowners, get_git_tracked_files(Path(folder_path)))
+        ownership_maps.put(cache_key, ownership)
+    return ownership
 
 
 def get_code_owner(window: sublime.Window, folder_path: str, file_name: str) -> Optional[CodeOwnerSpecification]:
-    # check cache first
-    if window.id() not in codeowner_window_cache.keys():
-        codeowner_window_cache[window.id()] = dict()
-    codeowners = codeowner_window_cache[window.id()].get(folder_path, None)
-    if not codeowners:
-        codeowners_file = get_code_owners_file(Path(folder_path))
-        if codeowners_file:
-            codeowners = list(parse_code_owners(codeowners_file, codeowners_file.read_text(encoding='utf-8')))
-
-            codeowner_window_cache[window.id()][folder_path] = codeowners
-            def clear_cache() -> None:
-                if window.id() in codeowner_window_cache:
-                    if folder_path in codeowner_window_cache[window.id()]:
-                        del codeowner_window_cache[window.id()][folder_path]
-            # TODO: clear cache early when codeowners is saved/reverted or if file time differs from cached i.e. changing branches? or offer entry in command palette for it
-            sublime.set_timeout_async(clear_cache, 1000 * 60 * 60) # 60 minutes
-
-    if codeowners:
-        relevant_codeowner_specification = get_resolved_code_owners_for_file(codeowners, Path(os.path.relpath(file_name, folder_path)))
-        if relevant_codeowner_specification:
-            return relevant_codeowner_specification
-
-    return None
-
+    loaded = get_code_owners_for_folder(window, folder_path)
+    if not loaded or not loaded.codeowners:
+        return None
 
-def get_git_change_owners_for_folder(window: sublime.Window, folder_path: Path, include_unowned: bool) -> Iterable[Tuple[Path, Optional[CodeOwnerSpecification]]]:
-    for file_path in get_git_changed_files_compared_to_default_branch(folder_path):
-        owner = get_code_owner(window, folder_path, file_path)
-        if owner or include_unowned:
-            yield (file_path, owner)
+    # the absolute file name identifies the relative path within the folder, without needing to compute it
+    cache_key = (folder_path, file_name, loaded.generation)
+    relevant_codeowner_specification = codeowner_resolution_cache.get(cache_key, _NOT_CACHED)
+    if relevant_codeowner_specification is _NOT_CACHED:
+        before = time.perf_counter()
+        relevant_codeowner_specification = get_resolved_code_owners_for_file(loaded.codeowners, Path(os.path.relpath(file_name, folder_path)))
+        stats.record_duration('resolve code owner', time.perf_counter() - before)
+        codeowner_resolution_cache.put(cache_key, relevant_codeowner_specification)
+    return relevant_codeowner_specification
+
+
+class GitChangeOwnersJob:
+    """Resolves the owners of the files changed compared to the default branch, for every folder in a window, on its own thread and event loop so that neither the UI nor the other async events are blocked.
+
+    Owners are resolved as git outputs the changed files, progress is shown in the status bar, and the job can be cancelled or will time out.
+    """
+
+    def __init__(self, window: sublime.Window, include_unowned: bool, on_done: Callable[[List[Tuple[Path, Optional[CodeOwnerSpecification]]]], None], timeout: float = 60, profile: bool = False):
+        self.window = window
+        self.include_unowned = include_unowned
+        self.on_done = on_done
+        self.timeout = timeout
+        self.results: List[Tuple[Path, Optional[CodeOwnerSpecification]]] = list()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.task: Optional[asyncio.Task] = None
+        self.cancelled = False
+        self.profile = profile
+        # (repository root, its rule set) for each of the window's repositories
+        self.rule_sets: List[Tuple[Path, Optional[LoadedCodeOwners]]] = list()
+        # held while the loop is closed, so that cancelling never schedules anything on a closed loop
+        self._loop_lock = threading.Lock()
+
+    def start(self) -> None:
+        # the rule sets are shared with the rest of the plugin, so they are loaded on the async thread like everywhere else, rather than on the job's own
+        sublime.set_timeout_async(self._load_rule_sets_and_run)
+
+    def _load_rule_sets_and_run(self) -> None:
+        self.rule_sets = [(Path(folder_path), get_code_owners_for_folder(self.window, folder_path)) for folder_path in get_code_owner_roots_for_window(self.window)]
+        threading.Thread(target=self._run, name='CodeOwnerInsights git changes', daemon=True).start()
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        with self._loop_lock:
+            if self.loop and self.task and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self.task.cancel)
+
+    def _run(self) -> None:
+        if not self.profile:
+            self._run_loop()
+            return
+        # the work all happens on this thread, so that is the only one which needs profiling
+        _, profile_report = profile_call(self._run_loop)
+        sublime.set_timeout(lambda: show_text_in_panel(self.window, 'codeowners_profile', profile_report))
+
+    def _run_loop(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.task = self.loop.create_task(asyncio.wait_for(self._resolve_all_folders(), self.timeout))
+            if self.cancelled: # before there was a task to cancel
+                self.task.cancel()
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            self.window.status_message('CodeOwnerInsights: cancelled')
+            return
+        except asyncio.TimeoutError:
+            self.window.status_message(f'CodeOwnerInsights: timed out after {self.timeout} seconds, showing partial results')
+        finally:
+            with self._loop_lock:
+                self.loop.close()
+        sublime.set_timeout(lambda: self.on_done(self.results))
+
+    async def _resolve_all_folders(self) -> None:
+        for folder_path, loaded in self.rule_sets:
+            await self._resolve_folder(folder_path, loaded)
+
+    async def _resolve_folder(self, folder_path: Path, loaded: Optional[LoadedCodeOwners]) -> None:
+        async for changed_files in stream_git_changed_files_compared_to_default_branch(folder_path):
+            if not loaded or not loaded.codeowners:
+                owned_files = ((file_path, None) for file_path in changed_files)
+            else:
+                # git paths are already relative to the repository root, and come out grouped by folder
+                owned_files = iter_resolved_code_owners(loaded.codeowners, changed_files)
+            self.results.extend((file_path, owner) for file_path, owner in owned_files if owner or self.include_unowned)
+            self.window.status_message(f'CodeOwnerInsights: resolved owners of {len(self.results)} changed files...')
 
 
-def get_git_change_owners(window: sublime.Window, include_unowned: bool) -> Iterable[Tuple[Path, Optional[CodeOwnerSpecification]]]:
-    for folder_path in window.folders():
-        for result in get_git_change_owners_for_folder(window, Path(folder_path), include_unowned):
-            yield result
+running_git_change_owners_jobs: Dict[int, GitChangeOwnersJob] = dict()
 
 
 class RevealCodeOwnerCommand(sublime_plugin.TextCommand):
@@ -131,38 +381,223 @@ class RevealCodeOwnerCommand(sublime_plugin.TextCommand):
             self.view.window().run_command('open_file', { 'file': str(codeowner.codeowners_file_path) + ':' + str(codeowner.line_number), 'encoded_position': True })
 
     def is_enabled(self) -> bool:
-        codeowner = get_code_owner_for_view(self.view)
+        # this runs on the UI thread, often, so no round trips to the daemon
+        codeowner = get_code_owner_for_view(self.view, use_daemon=False)
         return bool(codeowner)
 
 
 class ShowCodeOwnersForGitDefaultBranchDiffCommand(sublime_plugin.TextCommand):
-    def run(self, edit, include_unowned: bool = False):
-        result = list(get_git_change_owners(self.view.window(), include_unowned))
-        
-        # group by owners
-        # TODO: group by owner singular?
-        owner_tree = {}
-        for file, codeowner_spec in result:
-            if codeowner_spec and codeowner_spec.owners:
-                owners = ', '.join(codeowner_spec.owners)
-            else:
-                owners = '*UNOWNED*'
-            if owners not in owner_tree:
-                owner_tree[owners] = []
-            owner_tree[owners].append(str(file))
-
-        # format popup
-        popup_content = ''
-        for owners in owner_tree.keys():
-            popup_content += f'<h2>{owners}</h2>\n<ul>\n' # TODO: html escape
-            for file in owner_tree[owners]:
-                popup_content += f'<li>{file}</li>\n' # TODO: html escape # TODO: make clickable link to open codeowners file or file changed? hmm # TODO: show comment by file or subgroup by comment then file
-            popup_content += '</ul>\n'
-
-        self.view.show_popup(content=popup_content, location=self.view.sel()[0].a)
+    def run(self, edit, include_unowned: bool = False, profile: bool = False):
+        window = self.view.window()
+        previous_job = running_git_change_owners_jobs.pop(window.id(), None)
+        if previous_job:
+            previous_job.cancel()
+
+        def on_done(result: List[Tuple[Path, Optional[CodeOwnerSpecification]]]) -> None:
+            if running_git_change_owners_jobs.get(window.id()) is job:
+                del running_git_change_owners_jobs[window.id()]
+            self.show_popup(result)
+
+        job = GitChangeOwnersJob(window, include_unowned, on_done, profile=profile)
+        running_git_change_owners_jobs[window.id()] = job
+        job.start()
+
+    def show_popup(self, result: List[Tuple[Path, Optional[CodeOwnerSpecification]]]) -> None:
+        report = OwnershipReport(result)
+        window = self.view.window()
+        if report.file_count > PANEL_MIN_FILES:
+            show_report_in_panel(window, report)
+            return
+
+        expanded: Set[int] = set() if report.file_count > POPUP_MAX_EXPANDED_FILES else set(range(len(report.groups)))
+
+        def on_navigate(href: str) -> None:
+            action, _, argument = href.partition(':')
+            if action == 'expand':
+                expanded.add(int(argument))
+            elif action == 'collapse':
+                expanded.discard(int(argument))
+            elif action == 'panel':
+                self.view.hide_popup()
+                show_report_in_panel(window, report)
+                return
+            self.view.update_popup(report.render_html(expanded))
+
+        self.view.show_popup(content=report.render_html(expanded), location=self.view.sel()[0].a, max_width=1000, max_height=800, on_navigate=on_navigate)
 
     def is_enabled(self) -> bool:
         window_id = self.view.window().id()
         if window_id in codeowner_window_cache and codeowner_window_cache[window_id]:
             return True
         return False
+
+
+UNOWNED = '*UNOWNED*'
+# when the popup lists more files than this, owners start off collapsed and are expanded on click
+POPUP_MAX_EXPANDED_FILES = 200
+# the most files listed under a single expanded rule in the popup
+POPUP_MAX_FILES_PER_RULE = 100
+# when there are more changed files than this, they are shown in an output panel instead of a popup
+PANEL_MIN_FILES = 2000
+
+
+class OwnershipReport:
+    """Changed files grouped by owners, then by the CODEOWNERS rule which assigned them."""
+
+    def __init__(self, result: Iterable[Tuple[Path, Optional[CodeOwnerSpecification]]]):
+        # owners -> rule line number -> (rule, files)
+        self.groups: Dict[str, Dict[int, Tuple[Optional[CodeOwnerSpecification], List[str]]]] = dict()
+        self.file_count = 0
+        for file, codeowner_spec in result:
+            # TODO: group by owner singular?
+            owners = ', '.join(codeowner_spec.owners) if codeowner_spec and codeowner_spec.owners else UNOWNED
+            rules = self.groups.setdefault(owners, dict())
+            line_number = codeowner_spec.line_number if codeowner_spec else 0
+            rules.setdefault(line_number, (codeowner_spec, list()))[1].append(str(file))
+            self.file_count += 1
+
+    @staticmethod
+    def describe_rule(codeowner_spec: Optional[CodeOwnerSpecification]) -> str:
+        if not codeowner_spec:
+            return 'no matching rule'
+        nearest_comment = codeowner_spec.nearest_comment[1:].replace('\n#', '').strip() if codeowner_spec.nearest_comment else ''
+        return f'{codeowner_spec.glob_pattern} (line {codeowner_spec.line_number}){" - " + nearest_comment if nearest_comment else ""}'
+
+    def render_html(self, expanded: Set[int]) -> str:
+        parts = list()
+        for group_index, (owners, rules) in enumerate(self.groups.items()):
+            file_count = sum(len(files) for _, files in rules.values())
+            if group_index not in expanded:
+                parts.append(f'<h2><a href="expand:{group_index}">{html.escape(owners)}</a> ({file_count})</h2>')
+                continue
+
+            parts.append(f'<h2><a href="collapse:{group_index}">{html.escape(owners)}</a> ({file_count})</h2>')
+            for codeowner_spec, files in rules.values():
+                parts.append(f'<h3>{html.escape(self.describe_rule(codeowner_spec))}</h3><ul>')
+                parts.extend(f'<li>{html.escape(file)}</li>' for file in files[:POPUP_MAX_FILES_PER_RULE])
+                if len(files) > POPUP_MAX_FILES_PER_RULE:
+                    parts.append(f'<li><a href="panel:">and {len(files) - POPUP_MAX_FILES_PER_RULE} more...</a></li>')
+                parts.append('</ul>')
+        return '\n'.join(parts)
+
+    def render_text(self) -> str:
+        lines = list()
+        for owners, rules in self.groups.items():
+            lines.append(f'{owners} ({sum(len(files) for _, files in rules.values())})')
+            for codeowner_spec, files in rules.values():
+                lines.append(f'  {self.describe_rule(codeowner_spec)}')
+                lines.extend(f'    {file}' for file in files)
+        return '\n'.join(lines) + '\n'
+
+
+def show_report_in_panel(window: sublime.Window, report: OwnershipReport) -> None:
+    show_text_in_panel(window, 'codeowners', report.render_text())
+
+
+def show_text_in_panel(window: sublime.Window, panel_name: str, text: str) -> None:
+    panel = window.create_output_panel(panel_name)
+    panel.run_command('append', { 'characters': text, 'disable_tab_translation': True })
+    window.run_command('show_panel', { 'panel': f'output.{panel_name}' })
+
+
+class CancelCodeOwnersForGitDefaultBranchDiffCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        job = running_git_change_owners_jobs.pop(self.window.id(), None)
+        if job:
+            job.cancel()
+
+    def is_enabled(self) -> bool:
+        return self.window.id() in running_git_change_owners_jobs
+
+
+class ListCodeOwnerFilesCommand(sublime_plugin.WindowCommand):
+    """List the files owned by a user or team, picked from the owners named in the window's CODEOWNERS files unless given, and open the chosen one."""
+    def run(self, owner: Optional[str] = None):
+        sublime.set_timeout_async(lambda: self.run_async(owner))
+
+    def run_async(self, owner: Optional[str]) -> None:
+        rule_sets = list()
+        for folder_path in get_code_owner_roots_for_window(self.window):
+            loaded = get_code_owners_for_folder(self.window, folder_path)
+            if loaded and loaded.codeowners:
+                rule_sets.append((folder_path, loaded))
+        if owner:
+            self.list_files(rule_sets, owner)
+            return
+
+        rule_counts: Dict[str, int] = dict()
+        owners: Dict[str, str] = dict()
+        for _, loaded in rule_sets:
+            for name in loaded.codeowners.get_owners():
+                owners.setdefault(name.lower(), name)
+                rule_counts[name.lower()] = rule_counts.get(name.lower(), 0) + len(loaded.codeowners.get_rules_by_owner()[name.lower()])
+        items = [sublime.QuickPanelItem(name, annotation=f'{rule_counts[key]} rules') for key, name in owners.items()]
+        names = list(owners.values())
+
+        def on_select(index: int) -> None:
+            if index >= 0:
+                sublime.set_timeout_async(lambda: self.list_files(rule_sets, names[index]))
+
+        self.window.show_quick_panel(items, on_select, placeholder='Owner')
+
+    def list_files(self, rule_sets: List[Tuple[str, LoadedCodeOwners]], owner: str) -> None:
+        self.window.status_message(f'CodeOwnerInsights: finding the files owned by {owner}...')
+        files = list()
+        items = list()
+        for folder_path, loaded in rule_sets:
+            # folders are only named when there is more than one repository
+            prefix = os.path.basename(folder_path) + '/' if len(rule_sets) > 1 else ''
+            try:
+                ownership = get_ownership_map(folder_path, loaded)
+            except CalledProcessError as e:
+                # i.e. a project folder with a CODEOWNERS file which isn't a git repository
+                print(f'CodeOwnerInsights: {" ".join(e.cmd)} failed in {folder_path}: {e.stderr.strip()}')
+                continue
+            for path, codeowner_spec in ownership.get_paths_for_owner(owner):
+                files.append(os.path.join(folder_path, path))
+                items.append(sublime.QuickPanelItem(prefix + path, details=html.escape(codeowner_spec.glob_pattern), annotation=f'line {codeowner_spec.line_number}'))
+        if not files:
+            self.window.status_message(f'CodeOwnerInsights: {owner} owns no tracked files')
+            return
+
+        def on_select(index: int) -> None:
+            if index >= 0:
+                self.window.open_file(files[index])
+
+        self.window.status_message(f'CodeOwnerInsights: {owner} owns {len(files)} files')
+        self.window.show_quick_panel(items, on_select, placeholder=f'Files owned by {owner}')
+
+
+class ShowCodeOwnerInsightsStatsCommand(sublime_plugin.WindowCommand):
+    """Show the counters and timings recorded so far, along with the state of the caches and the most recent git commands."""
+    def run(self, reset: bool = False):
+        with code_owners_lock:
+            rule_sets = list(shared_code_owners.items())
+        lines = [
+            stats.format_report(),
+            'Caches:',
+            f'  code owner resolutions: {len(codeowner_resolution_cache)} entries, {codeowner_resolution_cache.hits} hits, {codeowner_resolution_cache.misses} misses',
+            f'  CODEOWNERS at git revisions: {len(code_owners_by_blob_id)} entries, {code_owners_by_blob_id.hits} hits, {code_owners_by_blob_id.misses} misses',
+            f'  rule sets: {len(rule_sets)}, with {sum(len(loaded.codeowners) for _, loaded in rule_sets)} rules',
+        ]
+        lines.extend(f'    {real_path}: {len(loaded.codeowners)} rules, generation {loaded.generation}' for real_path, loaded in rule_sets)
+        lines.append('Most recent git commands:')
+        lines.extend(f'  {duration * 1000:.1f}ms git {" ".join(args)}' for args, duration in reversed(get_git_command_timings()[-20:]))
+        show_text_in_panel(self.window, 'codeowners_stats', '\n'.join(lines) + '\n')
+        if reset:
+            stats.reset()
+
+
+class ProfileCodeOwnerLookupCommand(sublime_plugin.TextCommand):
+    """Profile finding the code owner of the current file and showing it in the status bar.
+
+    With `cold`, the caches are emptied first, so that finding and parsing the CODEOWNERS file is profiled too.
+    """
+    def run(self, edit, cold: bool = False):
+        if cold:
+            with code_owners_lock:
+                shared_code_owners.clear()
+            codeowner_resolution_cache.clear()
+        status_bar_states.pop(self.view.id(), None)
+        _, profile_report = profile_call(update_code_owner_in_status_bar, self.view)
+        show_text_in_panel(self.view.window(), 'codeowners_profile', profile_report)
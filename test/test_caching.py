@@ -0,0 +1,91 @@
+from pathlib import Path
+import sys
+import threading
+from codeowners import LRUCache, CompiledCodeOwners, parse_code_owners, save_cached_code_owners, load_cached_code_owners, get_cache_file_path
+
+
+def test_lru_cache_evicts_least_recently_used() -> None:
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', None)
+    assert cache.get('a') == 1 # 'b' is now the least recently used
+    cache.put('c', 3)
+    assert cache.get('b', 'missing') == 'missing'
+    assert cache.get('c') == 3
+    assert (cache.hits, cache.misses, len(cache)) == (2, 1, 2)
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_lru_cache_from_several_threads() -> None:
+    # i.e. the status bar looking up owners while a git changes job reloads the rules, clearing the cache
+    cache = LRUCache(maxsize=8)
+    errors = list()
+
+    def use_cache(clear: bool) -> None:
+        try:
+            for number in range(50000):
+                cache.put(number % 10, number)
+                cache.get((number + 1) % 10)
+                if clear and number % 7 == 0:
+                    cache.clear()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=use_cache, args=(index == 0,)) for index in range(4)]
+    # switch threads as often as possible, to make the races likely
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert errors == []
+    assert len(cache) <= 8
+
+
+def test_rules_cache_round_trip(tmp_path: Path) -> None:
+    codeowners_file = Path('CODEOWNERS')
+    content = '# comment\n*.js @js-owner\n/docs/ @doctocat @octocat\n\nunowned\n'
+    codeowners = CompiledCodeOwners(parse_code_owners(codeowners_file, content))
+
+    assert load_cached_code_owners(tmp_path, 'abc', codeowners_file) is None
+    save_cached_code_owners(tmp_path, 'abc', codeowners)
+    # the rules translated to be saved aren't translated again
+    assert None not in codeowners.matchers.regex_sources
+    cached = load_cached_code_owners(tmp_path, 'abc', codeowners_file)
+    assert cached.specifications == codeowners.specifications
+    assert cached.specifications[0].nearest_comment is cached.specifications[1].nearest_comment
+    assert [matcher.pattern for matcher in cached.matchers] == [matcher.pattern for matcher in codeowners.matchers]
+    assert cached.resolve('a/b.js') == codeowners.resolve('a/b.js')
+
+    assert load_cached_code_owners(tmp_path, 'other', codeowners_file) is None
+    get_cache_file_path(tmp_path, 'abc').write_bytes(b'corrupt')
+    assert load_cached_code_owners(tmp_path, 'abc', codeowners_file) is None
+
+
+def test_rules_cache_saved_from_several_threads(tmp_path: Path) -> None:
+    # i.e. the async thread and a git changes job both parsing the same file in full, and pruning each other's old cache files
+    codeowners_file = Path('CODEOWNERS')
+    codeowners = CompiledCodeOwners(parse_code_owners(codeowners_file, '*.js @js-owner\n'))
+    errors = list()
+
+    def save(index: int) -> None:
+        try:
+            for number in range(50):
+                save_cached_code_owners(tmp_path, 'abc', codeowners)
+                save_cached_code_owners(tmp_path, f'{index}-{number}', codeowners)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert list(tmp_path.glob('*.tmp')) == []
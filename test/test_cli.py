@@ -0,0 +1,101 @@
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from pathlib import Path
+from subprocess import run
+from typing import Dict, Iterator
+import json
+import pytest
+from cli import main, map_bounded, resolve
+import git as git_module
+
+
+def test_resolve_git_paths(tmp_path: Path) -> None:
+    (tmp_path / 'CODEOWNERS').write_text('* @default\n/docs/ @docs-team\n*.md @md\n', encoding='utf-8')
+    args = Namespace(repo=str(tmp_path), codeowners=None, revision=None, null=True)
+    output = StringIO()
+    # as piped from `git diff --name-only -z`
+    resolve(args, BytesIO(b'docs/a.txt\0docs/b.md\0src/c.py\0/docs/d.txt'), output)
+    assert output.getvalue().split('\0') == [
+        'docs/a.txt\t@docs-team\t2',
+        'docs/b.md\t@md\t3',
+        'src/c.py\t@default\t1',
+        '/docs/d.txt\t@docs-team\t2',
+        '',
+    ]
+
+
+def init_repo(repo: Path, files: Dict[str, str]) -> None:
+    for name, content in files.items():
+        (repo / name).parent.mkdir(parents=True, exist_ok=True)
+        (repo / name).write_text(content, encoding='utf-8')
+    run(['git', 'init', '-q'], cwd=repo, check=True)
+    run(['git', 'add', '.'], cwd=repo, check=True)
+
+
+def test_audit(tmp_path: Path, capsys) -> None:
+    init_repo(tmp_path, {
+        'CODEOWNERS': '/docs/ @docs-team\n*.py @python\n',
+        'docs/a.md': '',
+        'src/b.py': '',
+        'src/c.txt': '',
+        'README.md': '',
+    })
+    # one path at a time, so that more chunks are submitted than there are workers
+    main(['audit', str(tmp_path), '--jobs', '1', '--chunk-size', '1', '--json'])
+    assert json.loads(capsys.readouterr().out) == {
+        'files': 5,
+        'owners': { '@docs-team': 1, '@python': 1 },
+        'unowned': ['CODEOWNERS', 'README.md', 'src/c.txt'],
+    }
+
+
+def test_audit_outside_of_a_repository(tmp_path: Path, capsys) -> None:
+    (tmp_path / 'CODEOWNERS').write_text('* @default\n', encoding='utf-8')
+    with pytest.raises(SystemExit, match='git ls-files -z failed: fatal: not a git repository'):
+        main(['audit', str(tmp_path), '--jobs', '1'])
+    assert capsys.readouterr().out == ''
+
+
+def test_map_bounded() -> None:
+    consumed = list()
+
+    def items() -> Iterator[int]:
+        for item in range(10):
+            consumed.append(item)
+            yield item
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        results = map_bounded(executor, lambda item: item * 2, items(), 2)
+        assert next(results) == 0
+        # the items are only taken as there is room for them, rather than all up front
+        assert len(consumed) == 3
+        assert list(results) == [item * 2 for item in range(1, 10)]
+
+
+def test_dead_rules_without_files(tmp_path: Path) -> None:
+    (tmp_path / 'CODEOWNERS').write_text('* @default\n/docs/ @docs-team\n', encoding='utf-8')
+    pruned = tmp_path / 'pruned'
+    with pytest.raises(SystemExit, match='git ls-files -z failed'):
+        main(['dead-rules', str(tmp_path), '--prune', str(pruned)])
+    # a repository without any tracked files yet
+    run(['git', 'init', '-q'], cwd=tmp_path, check=True)
+    with pytest.raises(SystemExit, match='No files found'):
+        main(['dead-rules', str(tmp_path), '--prune', str(pruned)])
+    assert not pruned.exists()
+
+
+def test_diff_ownership_between_revisions(tmp_path: Path, capsys, monkeypatch) -> None:
+    init_repo(tmp_path, { 'CODEOWNERS': '*.py @old\n', 'a.py': '', 'b.md': '' })
+    git = ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+    run([*git, 'commit', '-q', '-m', 'first'], cwd=tmp_path, check=True)
+    (tmp_path / 'CODEOWNERS').write_text('*.py @new\n*.md @docs\n', encoding='utf-8')
+    run([*git, 'commit', '-q', '-a', '-m', 'second'], cwd=tmp_path, check=True)
+    processes = list()
+    popen = git_module.Popen
+    monkeypatch.setattr(git_module, 'Popen', lambda args, **kwargs: processes.append(args) or popen(args, **kwargs))
+
+    main(['diff-ownership', '--repo', str(tmp_path), '--old', 'HEAD~1', '--new', 'HEAD'])
+    assert capsys.readouterr().out == 'a.py\t@old\t@new\nb.md\t\t@docs\n'
+    # both revisions are read by the same cat-file processes
+    assert processes == [['git', 'cat-file', '--batch-check'], ['git', 'cat-file', '--batch']]
@@ -0,0 +1,81 @@
+from pathlib import Path
+from subprocess import run
+import os
+import socket
+import threading
+import pytest
+from daemon import UNIX_SOCKETS_SUPPORTED, OwnershipClient, OwnershipServer
+
+
+pytestmark = pytest.mark.skipif(not UNIX_SOCKETS_SUPPORTED, reason='needs Unix domain sockets')
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    run(['git', 'init', '-q'], cwd=repo, check=True)
+    (repo / '.github').mkdir()
+    (repo / '.github' / 'CODEOWNERS').write_text('*.py @python-owner\n/docs/ @docs-owner\n', encoding='utf-8')
+    return repo
+
+
+@pytest.fixture
+def server(tmp_path: Path):
+    server = OwnershipServer(str(tmp_path / 'daemon.sock'), poll_interval=60)
+    thread = threading.Thread(target=server.serve_forever, kwargs={ 'poll_interval': 0.05 })
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def test_resolve_over_socket(repo: Path, server: OwnershipServer, tmp_path: Path) -> None:
+    with OwnershipClient(server.server_address) as client:
+        assert client.is_available()
+        results = client.resolve([str(repo / 'src' / 'a.py'), str(repo / 'README.md'), str(tmp_path / 'not-in-a-repo.py')])
+        assert results[0].owners == ('@python-owner',)
+        assert results[0].line_number == 1
+        assert results[0].codeowners_file_path == repo / '.github' / 'CODEOWNERS'
+        assert results[1:] == [None, None]
+        assert client.resolve([str(repo / 'docs' / 'index.md')])[0].owners == ('@docs-owner',)
+        assert [result.owners for result in client.resolve(['docs/index.md', '/docs/index.md'], str(repo))] == [('@docs-owner',)] * 2
+
+        (repo / '.github' / 'CODEOWNERS').write_text('*.py @new-python-owner @another-owner\n', encoding='utf-8')
+        assert client.resolve([str(repo / 'a.py')])[0].owners == ('@new-python-owner', '@another-owner')
+
+        assert client.request({ 'command': 'stats' })['codeowners_files'] == { os.path.realpath(repo / '.github' / 'CODEOWNERS'): 1 }
+        with pytest.raises(ValueError):
+            client.request({ 'command': 'no-such-command' })
+    assert not OwnershipClient(str(tmp_path / 'no-such.sock')).is_available()
+
+
+def test_client_gives_up_quickly(tmp_path: Path) -> None:
+    # a server which accepts connections but never answers, i.e. because it is stuck
+    socket_path = str(tmp_path / 'stuck.sock')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server_socket:
+        server_socket.bind(socket_path)
+        server_socket.listen()
+        with OwnershipClient(socket_path, timeout=0.05) as client:
+            with pytest.raises(socket.timeout):
+                client.resolve(['/a.py'])
+        # not retried with a new connection, as a slow server isn't one which restarted
+        server_socket.setblocking(False)
+        server_socket.accept()[0].close()
+        with pytest.raises(BlockingIOError):
+            server_socket.accept()
+
+
+def test_client_with_stale_socket(tmp_path: Path) -> None:
+    # the socket file of a server which was killed, which nothing is listening on any more
+    socket_path = str(tmp_path / 'stale.sock')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server_socket:
+        server_socket.bind(socket_path)
+    with OwnershipClient(socket_path, timeout=0.05) as client:
+        assert client.is_available()
+        with pytest.raises(ConnectionRefusedError):
+            client.resolve(['/a.py'])
+        # and again, now that the connection has been given up
+        with pytest.raises(ConnectionRefusedError):
+            client.resolve(['/a.py'])
@@ -0,0 +1,153 @@
+from pathlib import Path
+from subprocess import CalledProcessError, run
+from typing import List
+import asyncio
+import signal
+import pytest
+from codeowners import get_code_owners_at_revision
+from git import GitCatFile, find_repository_root, forget_repository_roots, stream_git_changed_files_compared_to_default_branch, stream_git_log_changed_files
+
+
+def run_git_in(repo: Path, *args: str) -> str:
+    return run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args], cwd=repo, check=True, capture_output=True, encoding='utf-8').stdout
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    run_git_in(tmp_path, 'init', '-q')
+    (tmp_path / '.github').mkdir()
+    (tmp_path / '.github' / 'CODEOWNERS').write_text('*.py @python-owner\n', encoding='utf-8')
+    run_git_in(tmp_path, 'add', '.')
+    run_git_in(tmp_path, 'commit', '-q', '-m', 'first')
+    (tmp_path / '.github' / 'CODEOWNERS').write_text('*.py @new-python-owner\n', encoding='utf-8')
+    run_git_in(tmp_path, 'commit', '-q', '-a', '-m', 'second')
+    return tmp_path
+
+
+def test_code_owners_at_revision(repo: Path) -> None:
+    with GitCatFile(repo) as cat_file:
+        assert get_code_owners_at_revision(cat_file, 'HEAD').resolve('a.py').owners == ('@new-python-owner',)
+        first = get_code_owners_at_revision(cat_file, 'HEAD~1')
+        assert first.resolve('a.py').owners == ('@python-owner',)
+        # the same blob is only parsed once
+        assert get_code_owners_at_revision(cat_file, 'HEAD~1') is first
+        assert get_code_owners_at_revision(cat_file, 'no-such-revision') is None
+        assert cat_file.read_object('HEAD:.github/CODEOWNERS') == b'*.py @new-python-owner\n'
+
+
+def test_find_repository_root(repo: Path) -> None:
+    (repo / 'src' / 'nested').mkdir(parents=True)
+    (repo / 'vendor' / 'lib').mkdir(parents=True)
+    # submodules and worktrees have a `.git` file rather than a folder
+    (repo / 'vendor' / 'lib' / '.git').write_text('gitdir: ../../.git/modules/lib\n', encoding='utf-8')
+    assert find_repository_root(str(repo / 'src' / 'nested')) == str(repo)
+    assert find_repository_root(str(repo / 'vendor' / 'lib')) == str(repo / 'vendor' / 'lib')
+    assert find_repository_root(str(repo / 'vendor')) == str(repo)
+
+
+def test_stream_git_log_changed_files(repo: Path) -> None:
+    (repo / 'src').mkdir()
+    (repo / 'src' / 'a file.py').write_text('', encoding='utf-8')
+    (repo / 'b.md').write_text('', encoding='utf-8')
+    run_git_in(repo, 'add', '.')
+    run_git_in(repo, 'commit', '-q', '-m', 'third')
+    run_git_in(repo, 'commit', '-q', '--allow-empty', '-m', 'empty')
+    commits = run_git_in(repo, 'rev-list', 'HEAD').split()
+    assert list(stream_git_log_changed_files(repo)) == [
+        (commits[0], []),
+        (commits[1], ['b.md', 'src/a file.py']),
+        (commits[2], ['.github/CODEOWNERS']),
+        (commits[3], ['.github/CODEOWNERS']),
+    ]
+    assert [commit for commit, _ in stream_git_log_changed_files(repo, '--max-count=2')] == commits[:2]
+
+
+def test_stream_git_log_changed_files_failure(repo: Path) -> None:
+    with pytest.raises(CalledProcessError, match='exit status 128') as error:
+        list(stream_git_log_changed_files(repo, 'no-such-branch'))
+    assert 'no-such-branch' in error.value.stderr
+    # closing the generator early isn't a failure
+    changes = stream_git_log_changed_files(repo)
+    next(changes)
+    changes.close()
+
+
+def test_find_repository_root_notices_new_repositories(tmp_path: Path) -> None:
+    folder = tmp_path / 'project' / 'src'
+    folder.mkdir(parents=True)
+    assert find_repository_root(str(folder)) is None
+    # i.e. `git init` or a clone into an open project folder
+    run_git_in(tmp_path / 'project', 'init', '-q')
+    assert find_repository_root(str(folder)) == str(tmp_path / 'project')
+    # a submodule added later, below a remembered root
+    (folder / '.git').write_text('gitdir: ../.git/modules/src\n', encoding='utf-8')
+    assert find_repository_root(str(folder)) == str(tmp_path / 'project')
+    forget_repository_roots()
+    assert find_repository_root(str(folder)) == str(folder)
+    # and removed again
+    (folder / '.git').unlink()
+    assert find_repository_root(str(folder)) == str(tmp_path / 'project')
+
+
+@pytest.fixture
+def feature_branch(repo: Path) -> Path:
+    # a clone's origin/HEAD, without a remote to fetch from
+    run_git_in(repo, 'branch', '-q', '-m', 'main')
+    run_git_in(repo, 'update-ref', 'refs/remotes/origin/main', 'main')
+    run_git_in(repo, 'symbolic-ref', 'refs/remotes/origin/HEAD', 'refs/remotes/origin/main')
+    run_git_in(repo, 'checkout', '-q', '-b', 'feature')
+    return repo
+
+
+def test_stream_git_changed_files_compared_to_default_branch(feature_branch: Path) -> None:
+    (feature_branch / 'src').mkdir()
+    (feature_branch / 'src' / 'a file.py').write_text('', encoding='utf-8')
+    (feature_branch / '.github' / 'CODEOWNERS').write_text('*.py @feature-owner\n', encoding='utf-8')
+    run_git_in(feature_branch, 'add', '.')
+    run_git_in(feature_branch, 'commit', '-q', '-m', 'feature')
+    # only what changed since the branch was created counts, not what changed on main since
+    run_git_in(feature_branch, 'update-ref', 'refs/heads/main', 'HEAD~1')
+
+    async def collect() -> List[List[Path]]:
+        return [batch async for batch in stream_git_changed_files_compared_to_default_branch(feature_branch)]
+
+    batches = asyncio.run(collect())
+    assert [path for batch in batches for path in batch] == [Path('.github/CODEOWNERS'), Path('src/a file.py')]
+
+
+def test_stream_git_changed_files_compared_to_default_branch_cancelled(feature_branch: Path, monkeypatch) -> None:
+    # far more output than the pipe and the stream's buffer hold, so that git is still writing it when the task is cancelled
+    for index in range(5000):
+        (feature_branch / f'{index:05}{"x" * 200}.txt').write_text('', encoding='utf-8')
+    run_git_in(feature_branch, 'add', '.')
+    run_git_in(feature_branch, 'commit', '-q', '-m', 'many files')
+    processes = list()
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def record_process(*args, **kwargs):
+        process = await create_subprocess_exec(*args, **kwargs)
+        processes.append(process)
+        return process
+
+    monkeypatch.setattr(asyncio, 'create_subprocess_exec', record_process)
+    batches = list()
+
+    async def consume() -> None:
+        async for batch in stream_git_changed_files_compared_to_default_branch(feature_branch):
+            batches.append(batch)
+            # delivered while waiting for the next batch from git
+            asyncio.current_task().cancel()
+
+    async def cancelled() -> List[int]:
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.ensure_future(consume())
+        return_codes = [process.returncode for process in processes]
+        # let go of the processes while the loop they close their pipes on is still open
+        processes.clear()
+        return return_codes
+
+    return_codes = asyncio.run(cancelled())
+    assert len(batches) == 1
+    assert 0 < len(batches[0]) < 5000
+    # rev-parse and merge-base finished, and the diff was killed rather than left to finish
+    assert return_codes == [0, 0, -signal.SIGKILL]
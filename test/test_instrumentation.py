@@ -0,0 +1,31 @@
+from instrumentation import Histogram, Stats, profile_call
+
+
+def test_histogram_percentiles() -> None:
+    histogram = Histogram()
+    for value in range(1, 101):
+        histogram.record(value)
+    assert histogram.count == 100
+    assert histogram.maximum == 100
+    # the buckets are powers of two, so percentiles are upper bounds within a factor of two
+    assert 50 <= histogram.percentile(0.5) <= 100
+    assert histogram.percentile(0.99) == 100
+    assert Histogram().describe() == 'count=0'
+
+
+def test_stats_report() -> None:
+    stats = Stats()
+    stats.increment('rule set parsed')
+    with stats.timed('full parse'):
+        pass
+    stats.record_size('rules evaluated per lookup', 3)
+    report = stats.format_report()
+    assert 'rule set parsed: 1' in report
+    assert 'full parse: count=1' in report
+    assert 'rules evaluated per lookup: count=1 mean=3' in report
+    stats.reset()
+    assert stats.format_report() == 'Nothing recorded yet\n'
+
+    result, profile_report = profile_call(sorted, [3, 1, 2])
+    assert result == [1, 2, 3]
+    assert 'function calls' in profile_report
@@ -2,87 +2,137 @@ from textwrap import dedent
 import pytest
 from pathlib import Path
 from typing import Optional
-from codeowners import does_codeowner_glob_match
+from codeowners import does_codeowner_glob_match, translate_codeowner_glob, CodeOwnersIndex, CombinedMatcher, FolderPrefixes
+
+matching_cases = [
+    (
+        '/build/logs/foo/bar.log',
+        '/build/logs/',
+        True,
+    ),
+    (
+        '/build/logs/foo.log',
+        '/build/logs/',
+        True,
+    ),
+    (
+        '/baz/build/logs/foo/bar.log',
+        '/build/logs/',
+        False,
+    ),
+    (
+        '/path/to/a/file',
+        '*',
+        True,
+    ),
+    (
+        '/path/to/a/file.ext',
+        '*',
+        True,
+    ),
+    (
+        'file.js',
+        '*.js',
+        True,
+    ),
+    (
+        'path/to/file.js',
+        '*.js',
+        True,
+    ),
+    (
+        'path/to/file.jsx',
+        '*.js',
+        False,
+    ),
+    (
+        'docs/getting-started.md',
+        'docs/*',
+        True,
+    ),
+    (
+        'docs/build-app/troubleshooting.md',
+        'docs/*',
+        False,
+    ),
+    (
+        '/apps/github/some.file',
+        '/apps/github',
+        True,
+    ),
+    (
+        '/apps/github/subfolder/some.file',
+        '/apps/github',
+        False,
+    ),
+    (
+        '/logs/test.log',
+        '**/logs',
+        True,
+    ),
+    (
+        '/build/logs/test.log',
+        '**/logs',
+        True,
+    ),
+    (
+        '/logs/subfolder/test.log',
+        '**/logs',
+        False,
+    ),
+]
+
+
+@pytest.mark.parametrize(('path', 'glob', 'expected_result'), matching_cases)
+def test_matching(path: str, glob: str, expected_result: bool) -> None:
+    assert does_codeowner_glob_match(glob, path) == expected_result
+
+
+@pytest.mark.parametrize(('path', 'glob', 'expected_result'), matching_cases)
+def test_combined_matching(path: str, glob: str, expected_result: bool) -> None:
+    assert (CombinedMatcher([0], [translate_codeowner_glob(glob)]).match(path) == 0) == expected_result
+
+
+def test_combined_matcher_finds_last_matching_rule() -> None:
+    globs = [glob for _, glob, _ in matching_cases]
+    # a small chunk size, so that the rules are spread over several alternations
+    matcher = CombinedMatcher(range(len(globs)), [translate_codeowner_glob(glob) for glob in globs], chunk_size=3)
+    for path, _, _ in matching_cases:
+        expected = max((index for index, glob in enumerate(globs) if does_codeowner_glob_match(glob, path)), default=-1)
+        assert matcher.match(path) == expected
+
+
+index_patterns = ['*', '/build/logs/', '/build/', '*.js', 'docs/*', '**/logs', '/apps/github', 'src/**/test', '?x']
+
 
 @pytest.mark.parametrize(
-    ('path', 'glob', 'expected_result'),
+    ('path', 'expected_candidates'),
     [
-        (
-            '/build/logs/foo/bar.log',
-            '/build/logs/',
-            True,
-        ),
-        (
-            '/build/logs/foo.log',
-            '/build/logs/',
-            True,
-        ),
-        (
-            '/baz/build/logs/foo/bar.log',
-            '/build/logs/',
-            False,
-        ),
-        (
-            '/path/to/a/file',
-            '*',
-            True,
-        ),
-        (
-            '/path/to/a/file.ext',
-            '*',
-            True,
-        ),
-        (
-            'file.js',
-            '*.js',
-            True,
-        ),
-        (
-            'path/to/file.js',
-            '*.js',
-            True,
-        ),
-        (
-            'path/to/file.jsx',
-            '*.js',
-            False,
-        ),
-        (
-            'docs/getting-started.md',
-            'docs/*',
-            True,
-        ),
-        (
-            'docs/build-app/troubleshooting.md',
-            'docs/*',
-            False,
-        ),
-        (
-            '/apps/github/some.file',
-            '/apps/github',
-            True,
-        ),
-        (
-            '/apps/github/subfolder/some.file',
-            '/apps/github',
-            False,
-        ),
-        (
-            '/logs/test.log',
-            '**/logs',
-            True,
-        ),
-        (
-            '/build/logs/test.log',
-            '**/logs',
-            True,
-        ),
-        (
-            '/logs/subfolder/test.log',
-            '**/logs',
-            False,
-        ),
+        ('/build/logs/foo.log', {'*', '/build/logs/', '/build/', '**/logs', '?x'}),
+        ('build/logs/foo.log', {'*', '**/logs', '?x'}),
+        ('/path/to/file.js', {'*', '*.js', '?x'}),
+        ('a/docs/getting-started.md', {'*', 'docs/*', '?x'}),
+        ('/apps/github/some.file', {'*', '/apps/github', '?x'}),
+        ('/apps/other/some.file', {'*', '?x'}),
+        ('src/a/test/file.py', {'*', 'src/**/test', '?x'}),
     ]
 )
-def test_matching(path: str, glob: str, expected_result: bool) -> None:
-    assert does_codeowner_glob_match(glob, path) == expected_result
+def test_index_candidates(path: str, expected_candidates: set) -> None:
+    index = CodeOwnersIndex(index_patterns)
+    assert {index_patterns[rule_index] for rule_index in index.get_candidates(path)} == expected_candidates
+
+
+@pytest.mark.parametrize(
+    ('file_name', 'expected_folders'),
+    [
+        ('/work/mono/apps/web/index.js', ['/work/mono/apps/web', '/work/mono']),
+        ('/work/mono/apps/webby/index.js', ['/work/mono']),
+        ('/work/mono/apps/api/main.py', ['/work/mono']),
+        ('/work/monorepo/file', []),
+        ('/work/mono-tools/bin/run', ['/work/mono-tools']),
+        ('/elsewhere/file', []),
+    ]
+)
+def test_folders_containing(file_name: str, expected_folders: list) -> None:
+    folders = FolderPrefixes(['/work/mono', '/work/mono/apps/web', '/work/mono-tools', '/work/mono/apps/a', '/work/mono/docs'])
+    assert list(folders.get_folders_containing(file_name)) == expected_folders
@@ -1,8 +1,9 @@
 from textwrap import dedent
 import pytest
 from pathlib import Path
+import os
 from typing import Optional
-from codeowners import parse_code_owners, get_resolved_code_owners_for_file, CodeOwnerSpecification
+from codeowners import parse_code_owners, get_resolved_code_owners_for_file, CodeOwnerSpecification, CompiledCodeOwners, OwnershipHistory, OwnershipMap, resolve_many, iter_resolved_code_owners, load_code_owners, find_changed_lines, reparse_code_owners, diff_ownership, find_covered_rules, find_dead_rules, prune_code_owners
 
 fake_path = Path('test/CODEOWNERS')
 
@@ -82,6 +83,7 @@ codeowners_content = dedent("""\
     x @y
 """)
 codeowners = list(parse_code_owners(fake_path, codeowners_content))
+compiled_codeowners = CompiledCodeOwners(codeowners)
 
 
 @pytest.mark.parametrize(
@@ -94,7 +96,7 @@ codeowners = list(parse_code_owners(fake_path, codeowners_content))
                 '# `/build/logs`, `/scripts/logs`, and `/deeply/nested/logs`. Any changes\n' +
                 '# in a `/logs` directory will require approval from @octocat.',
                 '**/logs',
-                ['@octocat'],
+                ('@octocat',),
                 53,
                 fake_path,
             ),
@@ -106,7 +108,7 @@ codeowners = list(parse_code_owners(fake_path, codeowners_content))
                 '# directory at the root of the repository and any of its\n' +
                 '# subdirectories.',
                 '/build/logs/',
-                ['@doctocat'],
+                ('@doctocat',),
                 30,
                 fake_path,
             ),
@@ -120,7 +122,7 @@ codeowners = list(parse_code_owners(fake_path, codeowners_content))
                 '# to `apps/github` can be made with the approval of any user who has\n' +
                 '# write access to the repository.',
                 '/apps/github',
-                [],
+                (),
                 61,
                 fake_path,
             ),
@@ -133,7 +135,7 @@ codeowners = list(parse_code_owners(fake_path, codeowners_content))
                 '# modifies JS files, only @js-owner and not the global\n' +
                 '# owner(s) will be requested for a review.',
                 '*.js',
-                ['@js-owner'],
+                ('@js-owner',),
                 14,
                 fake_path,
             ),
@@ -146,7 +148,7 @@ codeowners = list(parse_code_owners(fake_path, codeowners_content))
                 '# @global-owner1 and @global-owner2 will be requested for\n' +
                 '# review when someone opens a pull request.',
                 '*',
-                ['@global-owner1', '@global-owner2'],
+                ('@global-owner1', '@global-owner2'),
                 8,
                 fake_path,
             ),
@@ -158,7 +160,7 @@ codeowners = list(parse_code_owners(fake_path, codeowners_content))
                 '# directory in the root of your repository and any of its\n' +
                 '# subdirectories.',
                 '/docs/',
-                ['@doctocat'],
+                ('@doctocat',),
                 44,
                 fake_path,
             ),
@@ -170,7 +172,7 @@ codeowners = list(parse_code_owners(fake_path, codeowners_content))
                 '# `docs/getting-started.md` but not further nested files like\n' +
                 '# `docs/build-app/troubleshooting.md`.',
                 'docs/*',
-                ['docs@example.com'],
+                ('docs@example.com',),
                 35,
                 fake_path,
             ),
@@ -183,7 +185,7 @@ codeowners = list(parse_code_owners(fake_path, codeowners_content))
                 '# @global-owner1 and @global-owner2 will be requested for\n' +
                 '# review when someone opens a pull request.',
                 '*',
-                ['@global-owner1', '@global-owner2'],
+                ('@global-owner1', '@global-owner2'),
                 8, # NOT line 35
                 fake_path,
             ),
@@ -193,7 +195,7 @@ codeowners = list(parse_code_owners(fake_path, codeowners_content))
             CodeOwnerSpecification(
                 '# test',
                 'z',
-                ['@z'],
+                ('@z',),
                 70,
                 fake_path,
             ),
@@ -204,13 +206,205 @@ codeowners = list(parse_code_owners(fake_path, codeowners_content))
                 '# another test with no blank lines between these\n' +
                 '# comments and the prev rule',
                 'x',
-                ['@y'],
+                ('@y',),
                 73,
                 fake_path,
             ),
         ),
     ]
 )
-def test_parsing(path: str, expected_owner: Optional[CodeOwnerSpecification]) -> None:
-    owner = get_resolved_code_owners_for_file(codeowners, Path(path))
+@pytest.mark.parametrize('rules', [codeowners, compiled_codeowners], ids=['list', 'compiled'])
+def test_parsing(rules, path: str, expected_owner: Optional[CodeOwnerSpecification]) -> None:
+    owner = get_resolved_code_owners_for_file(rules, Path(path))
     assert owner == expected_owner
+
+
+def test_resolve_many() -> None:
+    paths = ['/build/logs/bar.log', 'a/docs/getting-started.md', '/some/path/to/file.js', '/build/logs/nested/bar.log', 'x', '/some/path/to/file.test', 'unowned/../x']
+    expected = {path: get_resolved_code_owners_for_file(codeowners, Path(path)) for path in paths}
+    assert resolve_many(codeowners, paths) == expected
+    assert dict(iter_resolved_code_owners(compiled_codeowners, paths)) == expected
+
+
+def test_load_code_owners_reuses_unchanged_file(tmp_path: Path) -> None:
+    codeowners_file = tmp_path / 'CODEOWNERS'
+    codeowners_file.write_text(codeowners_content, encoding='utf-8')
+    loaded = load_code_owners(codeowners_file)
+    assert loaded.parsed_in_full
+    assert load_code_owners(codeowners_file, loaded) is loaded
+
+    # same content but a different modification time
+    os.utime(codeowners_file, ns=(0, 0))
+    assert load_code_owners(codeowners_file, loaded) is loaded
+
+    codeowners_file.write_text(codeowners_content + 'y @z\n', encoding='utf-8')
+    reloaded = load_code_owners(codeowners_file, loaded)
+    assert reloaded is not loaded
+    assert not reloaded.parsed_in_full # only the appended line was parsed
+    assert len(reloaded.codeowners) == len(loaded.codeowners) + 1
+
+
+@pytest.mark.parametrize(
+    ('old_line', 'new_lines'),
+    [
+        ('*.js    @js-owner #This is an inline comment.', ['*.js    @someone-else']), # changed rule
+        ('# precedence. When someone opens a pull request that only', []), # removed comment line
+        ('# the octocats team in the octo-org organization owns all .txt files.', ['# a new comment', '*.md @new-owner']), # added lines
+        ('', []), # merged two blocks
+        ('x @y', ['x @y', '', 'y @x']), # appended a block
+    ]
+)
+def test_reparse_matches_full_parse(old_line: str, new_lines: list) -> None:
+    old_lines = codeowners_content.splitlines()
+    line_index = old_lines.index(old_line)
+    new_content = '\n'.join(old_lines[:line_index] + new_lines + old_lines[line_index + 1:])
+
+    changed_lines = find_changed_lines(codeowners_content, new_content)
+    reparsed = reparse_code_owners(compiled_codeowners, fake_path, new_content, *changed_lines)
+    assert reparsed.specifications == list(parse_code_owners(fake_path, new_content))
+
+
+def test_diff_ownership() -> None:
+    new_content = codeowners_content.replace('*.js    @js-owner', '*.js    @new-js-owner').replace('/build/logs/ @doctocat', '')
+    new_codeowners = list(parse_code_owners(fake_path, new_content))
+    paths = ['/some/path/to/file.js', '/build/logs/nested/bar.log', '/build/logs/bar.log', '/docs/a/b', 'x']
+
+    changes = {change.path: (change.old_owner.owners, change.new_owner.owners) for change in diff_ownership(codeowners, new_codeowners, paths)}
+    assert changes == {
+        '/some/path/to/file.js': (('@js-owner',), ('@new-js-owner',)),
+        '/build/logs/nested/bar.log': (('@doctocat',), ('@global-owner1', '@global-owner2')),
+    }
+    # the changes to anchored rules are found for paths as `git ls-files` lists them too
+    assert {change.path for change in diff_ownership(codeowners, new_codeowners, [path.lstrip('/') for path in paths])} == {'some/path/to/file.js', 'build/logs/nested/bar.log'}
+
+
+def test_paths_without_leading_slash() -> None:
+    # as output by `git ls-files` or `git diff --name-only`
+    rules = list(parse_code_owners(fake_path, dedent("""\
+        * @default
+        /docs/ @docs-team
+        /src/ @src-team
+        *.md @md
+        lib/ @lib
+        """)))
+    compiled = CompiledCodeOwners(rules)
+    expected = {
+        'docs/a.txt': '@docs-team',
+        'src/main.py': '@src-team',
+        'src/README.md': '@md',
+        'lib/x.py': '@lib',
+        'src/lib/x.py': '@lib',
+        'other/docs/a.txt': '@default',
+        'x': '@default',
+    }
+    for path, owner in expected.items():
+        for variant in (path, '/' + path, Path(path)):
+            assert compiled.resolve(variant).owners == (owner,)
+            assert get_resolved_code_owners_for_file(rules, variant).owners == (owner,)
+    assert {path: codeowner.owners[0] for path, codeowner in iter_resolved_code_owners(compiled, expected)} == expected
+
+def test_ownership_map() -> None:
+    paths = ['/build/logs/bar.log', 'a/docs/getting-started.md', '/some/path/to/file.js', 'x', '/some/path/to/file.test', 'src/main.go']
+    ownership = OwnershipMap(codeowners, paths)
+    assert ownership.rule_by_path == resolve_many(codeowners, paths)
+    for owner in ownership.codeowners.get_owners():
+        expected = {path for path, specification in ownership.rule_by_path.items() if specification and owner.lower() in (o.lower() for o in specification.owners)}
+        assert {path for path, _ in ownership.get_paths_for_owner(owner)} == expected
+        assert {path for path, _ in ownership.get_paths_for_owner(owner.upper())} == expected
+    assert list(ownership.get_paths_for_owner('@nobody')) == []
+    assert ownership.unowned == [path for path, specification in ownership.rule_by_path.items() if not specification or not specification.owners]
+
+    # `git ls-files` paths have no leading slash, and are kept as they were given
+    ownership = OwnershipMap(codeowners, ['docs/a/b.txt', 'scripts/deploy.sh', 'apps/web.py', 'build/logs/bar.log', 'src/main.go'])
+    assert sorted(path for path, _ in ownership.get_paths_for_owner('@doctocat')) == ['docs/a/b.txt', 'scripts/deploy.sh']
+    assert sorted(path for path, _ in ownership.get_paths_for_owner('@octocat')) == ['apps/web.py', 'build/logs/bar.log', 'scripts/deploy.sh']
+
+
+def test_ownership_history() -> None:
+    rules = parse_code_owners(fake_path, dedent("""\
+        *.js @js
+        *.md @docs
+        /apps/ @apps @js
+        """))
+    # a cache smaller than the number of paths, so that some are resolved again
+    history = OwnershipHistory(rules, path_cache_size=2, widest_commit_count=2)
+    # as `git log` outputs them, without a leading slash
+    history.add_commit('a', ['apps/index.js', 'README.md', 'setup.py'])
+    history.add_commit('b', ['lib/x.js', 'lib/y.js'])
+    history.add_commit('c', [])
+    history.add_commit('d', ['apps/main.py', 'docs/a.md'])
+    assert history.commit_count == 4
+    assert history.file_change_count == 7
+    assert history.unowned_file_change_count == 1
+    assert history.commits_by_owner == { '@js': 3, '@apps': 2, '@docs': 2 }
+    assert history.file_changes_by_owner == { '@js': 4, '@apps': 2, '@docs': 2 }
+    assert history.owners_per_commit.count == 4
+    assert history.owners_per_commit.maximum == 3
+    assert history.get_widest_commits() == [('a', 3), ('d', 3)]
+    assert len(history.owners_by_path) == 2
+
+
+def test_dead_rules() -> None:
+    content = dedent("""\
+        /apps/web/ @web
+        *.js @js
+        /apps/ @apps
+        *.md @docs
+        /apps/api/ @api
+        *.js @js-again
+        /unused/ @nobody
+        """)
+    rules = CompiledCodeOwners(parse_code_owners(fake_path, content))
+    paths = ['/apps/web/index.js', '/apps/api/main.py', '/apps/api/docs/readme.md', '/apps/api/test.js']
+    dead_rules = find_dead_rules(rules, paths)
+    assert [(dead_rule.specification.line_number, dead_rule.reason, dead_rule.shadowed_by.line_number if dead_rule.shadowed_by else None) for dead_rule in dead_rules] == [
+        (1, 'covered', 3),
+        (2, 'duplicate', 6),
+        (3, 'shadowed', None),
+        (4, 'shadowed', None),
+        (7, 'unmatched', None),
+    ]
+    pruned = prune_code_owners(rules, dead_rules)
+    assert [specification.line_number for specification in pruned] == [5, 6]
+    for path in paths:
+        assert pruned.resolve(path) is rules.resolve(path)
+    # paths as `git ls-files` outputs them, without a leading slash, give the same results
+    assert find_dead_rules(rules, [path.lstrip('/') for path in paths]) == dead_rules
+
+    rules = CompiledCodeOwners(parse_code_owners(fake_path, '* @default\n/docs/ @docs-team\n/src/ @src-team\n*.md @md\n'))
+    assert find_dead_rules(rules, ['docs/a.txt', 'src/b.py', 'README.md', 'CODEOWNERS']) == []
+
+
+def test_covered_rules_with_hidden_files() -> None:
+    # neither `**` nor a folder rule like `/apps/` matches names starting with a dot
+    content = dedent("""\
+        .github/ @gh
+        /apps/.config/ @cfg
+        /apps/.config/x/ @cfg-x
+        /apps/web/ @web
+        /apps/ @apps
+        /apps/.config/ @cfg-again
+        ** @all
+        """)
+    rules = CompiledCodeOwners(parse_code_owners(fake_path, content))
+    assert [(dead_rule.specification.line_number, dead_rule.reason, dead_rule.shadowed_by.line_number) for dead_rule in find_covered_rules(rules.specifications)] == [
+        (2, 'duplicate', 6),
+        (3, 'covered', 6),
+        (4, 'covered', 5),
+    ]
+    assert [(dead_rule.specification.line_number, dead_rule.reason) for dead_rule in find_covered_rules(list(parse_code_owners(fake_path, '/apps/.env @a\n.github/ @b\n* @all\n')))] == [
+        (1, 'covered'),
+        (2, 'covered'),
+    ]
+
+
+def test_wildcard_rules_matched_together() -> None:
+    # enough rules without a literal leading folder or extension that they are matched with a single combined regex
+    wildcard_rules = ''.join(f'*/team{number}/ @team{number}\n' for number in range(10))
+    content = '* @everyone\n' + wildcard_rules + '/apps/ @apps\n*/team3/ @team3-again\n*.md @docs\n'
+    rules = list(parse_code_owners(fake_path, content))
+    compiled = CompiledCodeOwners(rules)
+    assert compiled.fallback_rules
+    paths = ['/apps/team3/x.py', 'apps/team3/x.py', 'apps/team3/readme.md', 'a/team5/b', 'team5/b', 'README', '/apps/x']
+    for path in paths:
+        assert compiled.resolve(path) == get_resolved_code_owners_for_file(rules, Path(path))